@@ -2,21 +2,30 @@ import os
 import json
 import functools
 import datetime
-import subprocess
-import psutil
 import sys
 import atexit
 import re
+import time
+import logging
+import shutil
+import tempfile
 from zoneinfo import ZoneInfo
 from flask import (
     Flask, render_template, request, redirect, url_for, session, g,
-    jsonify, flash
+    jsonify, flash, Response, stream_with_context
 )
-from sqlalchemy import desc, or_
+from sqlalchemy import desc, func, case
 from sqlalchemy.exc import IntegrityError
 from waitress import serve
 from werkzeug.security import generate_password_hash, check_password_hash
-from database import SessionLocal, User, BlockedKeyword, SentMessage, init_db, Config, StartMessage
+from database import SessionLocal, User, BlockedKeyword, SentMessage, init_db, Config, StartMessage, bump_version, \
+    DailyStat, KEYWORDS_VERSION, CONFIG_VERSION, BLOCKED_VERSION, USERS_VERSION
+from message_search import filter_messages, uses_fts, snippet_column, rank_column, highlight
+from pagination import keyset_page, page_size, encode_cursor, decode_cursor, InvalidCursor
+from message_archive import search_archive, ARCHIVE_CURSOR_PREFIX
+from user_search import filter_users, log_search
+from bot_supervisor import BotSupervisor
+from keyword_io import import_keywords, iter_lines, iter_export
 
 from database import init_db
 
@@ -34,15 +43,10 @@ def is_valid_secret_token(token):
     return bool(re.match("^[A-Za-z0-9_-]*$", token))
 
 
-def is_configured():
-    from database import SessionLocal, Config
-    db = SessionLocal()
-    exists = db.query(Config).first() is not None
-    db.close()
-    return exists
+_config_cache = None
 
 
-def get_config():
+def load_config():
     from database import SessionLocal, Config
     db = SessionLocal()
     c = db.query(Config).first()
@@ -63,6 +67,25 @@ def get_config():
     return conf
 
 
+def get_config():
+    global _config_cache
+    if _config_cache is None:
+        conf = load_config()
+        if not conf:
+            return {}
+        _config_cache = conf
+    return _config_cache
+
+
+def invalidate_config():
+    global _config_cache
+    _config_cache = None
+
+
+def is_configured():
+    return bool(get_config())
+
+
 @app.before_request
 def load_db_session():
     if is_configured() and request.endpoint not in ['setup', 'static']:
@@ -155,8 +178,9 @@ def setup():
             db.add(cfg)
             db.commit()
             db.close()
+            invalidate_config()
             app.secret_key = secret_key
-            start_bot()
+            BOT_SUPERVISOR.start()
             flash('配置成功！请登录。', 'success')
             return redirect(url_for('login'))
         except IOError as e:
@@ -214,6 +238,10 @@ def api_get_settings():
         'update_method': config.update_method,
         'webhook_domain': config.webhook_domain,
         'webhook_secret': config.webhook_secret,
+        'max_concurrent_updates': config.max_concurrent_updates or 16,
+        'message_map_max_age_days': config.message_map_max_age_days,
+        'message_map_max_rows': config.message_map_max_rows,
+        'message_retention_days': config.message_retention_days,
     })
 
 
@@ -254,6 +282,22 @@ def api_save_settings():
     if update_method == 'webhook' and not is_valid_secret_token(webhook_secret):
         return jsonify({'error': 'Webhook 密钥包含不允许的字符。只允许使用 A-Z, a-z, 0-9, _ 和 -'}), 400
 
+    try:
+        max_concurrent_updates = int(data.get('max_concurrent_updates') or 16)
+    except (ValueError, TypeError):
+        max_concurrent_updates = 16
+    max_concurrent_updates = max(1, min(max_concurrent_updates, 256))
+
+    try:
+        config.message_map_max_age_days = max(0, int(data.get('message_map_max_age_days') or 0))
+        config.message_map_max_rows = max(0, int(data.get('message_map_max_rows') or 0))
+        config.message_retention_days = max(0, int(data.get('message_retention_days') or 0))
+    except (ValueError, TypeError):
+        return jsonify({'error': '保留天数和保留条数必须是非负整数'}), 400
+
+    old_connection = (config.update_method, config.webhook_domain, config.webhook_secret,
+                      config.max_concurrent_updates)
+    config.max_concurrent_updates = max_concurrent_updates
     config.update_method = update_method
     if update_method == 'webhook':
         if not webhook_domain:
@@ -264,9 +308,14 @@ def api_save_settings():
         config.webhook_domain = None
         config.webhook_secret = None
 
+    bump_version(g.db, CONFIG_VERSION)
     g.db.commit()
-    restart_bot()
-    return jsonify({'success': True, 'message': '设置已保存！机器人正在重启以应用更改...'})
+    invalidate_config()
+    if old_connection != (config.update_method, config.webhook_domain, config.webhook_secret,
+                          config.max_concurrent_updates):
+        BOT_SUPERVISOR.restart()
+        return jsonify({'success': True, 'message': '设置已保存！机器人正在重启以应用更改...'})
+    return jsonify({'success': True, 'message': '设置已保存！机器人将在几秒内自动应用更改。'})
 
 
 @app.route('/api/core-settings', methods=['POST'])
@@ -298,8 +347,10 @@ def api_save_core_settings():
     if web_pass:
         config.web_pass = generate_password_hash(web_pass)
 
+    bump_version(g.db, CONFIG_VERSION)
     g.db.commit()
-    restart_bot()
+    invalidate_config()
+    BOT_SUPERVISOR.restart()
 
     return jsonify({'success': True, 'message': '核心设置已保存！机器人正在重启。如果修改了Web密码，您可能需要重新登录。'})
 
@@ -341,9 +392,11 @@ def api_save_start_messages():
 @app.route('/api/stats')
 @login_required
 def api_stats():
-    total_users = g.db.query(User).count()
-    blocked_users = g.db.query(User).filter_by(is_blocked=True).count()
-    verified_users = g.db.query(User).filter_by(is_verified=True).count()
+    total_users, blocked_users, verified_users = g.db.query(
+        func.count(User.id),
+        func.count(case((User.is_blocked == True, 1))),
+        func.count(case((User.is_verified == True, 1)))
+    ).one()
     total_keywords = g.db.query(BlockedKeyword).count()
     return jsonify({
         'total_users': total_users,
@@ -366,11 +419,16 @@ def api_today_stats():
     messages_count = messages_q.count()
     dialog_users_count = g.db.query(SentMessage.user_id).filter(SentMessage.sent_at >= start_utc,
                                                                 SentMessage.sent_at < end_utc).distinct().count()
+    # 这几项只由机器人累计进 daily_stats，最多落后一个写入周期（30 秒）。
+    rollup = g.db.get(DailyStat, start_sh.date().isoformat())
     return jsonify({
         'date': start_sh.date().isoformat(),
         'new_users_today': new_users,
         'dialog_users_today': dialog_users_count,
-        'messages_today': messages_count
+        'messages_today': messages_count,
+        'blocked_hits_today': rollup.blocked_hits if rollup else 0,
+        'verifications_passed_today': rollup.verifications_passed if rollup else 0,
+        'verifications_failed_today': rollup.verifications_failed if rollup else 0
     })
 
 
@@ -383,20 +441,22 @@ def api_message_stats():
     now_sh = datetime.datetime.now(SH_TZ)
     start_sh = (now_sh - datetime.timedelta(days=days - 1)).replace(hour=0, minute=0, second=0, microsecond=0)
     end_sh = now_sh.replace(hour=23, minute=59, second=59, microsecond=999999)
-    start_utc = start_sh.astimezone(ZoneInfo('UTC'))
     end_utc = end_sh.astimezone(ZoneInfo('UTC'))
-    msgs = g.db.query(SentMessage).filter(SentMessage.sent_at >= start_utc, SentMessage.sent_at <= end_utc).all()
+    today = now_sh.date().isoformat()
+    today_start_utc = now_sh.replace(hour=0, minute=0, second=0, microsecond=0).astimezone(ZoneInfo('UTC'))
     counts = {}
     for i in range(days):
         d = (start_sh + datetime.timedelta(days=i)).date().isoformat()
         counts[d] = 0
-    for m in msgs:
-        if not m.sent_at:
-            continue
-        m_sh = m.sent_at.astimezone(SH_TZ)
-        d = m_sh.date().isoformat()
+    rows = g.db.query(DailyStat.day, DailyStat.messages) \
+        .filter(DailyStat.day >= start_sh.date().isoformat(), DailyStat.day < today) \
+        .all()
+    for d, count in rows:
         if d in counts:
-            counts[d] += 1
+            counts[d] = count
+    counts[today] = g.db.query(func.count(SentMessage.pk_id)) \
+        .filter(SentMessage.sent_at >= today_start_utc, SentMessage.sent_at <= end_utc) \
+        .scalar()
     data = [{'date': d, 'count': counts[d]} for d in sorted(counts.keys())]
     return jsonify({'range_days': days, 'data': data})
 
@@ -404,23 +464,22 @@ def api_message_stats():
 @app.route('/api/keywords', methods=['GET'])
 @login_required
 def api_get_keywords():
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 10, type=int)
+    per_page = page_size(request.args.get('per_page', type=int))
+    cursor = request.args.get('cursor') or None
     query_str = request.args.get('search', '').strip().lower()
     query = g.db.query(BlockedKeyword)
     if query_str:
         search_term = f"%{query_str}%"
         query = query.filter(BlockedKeyword.keyword.like(search_term))
-    total = query.count()
-    keywords = query.order_by(desc(BlockedKeyword.added_at)) \
-        .offset((page - 1) * per_page) \
-        .limit(per_page) \
-        .all()
+    total = query.count() if request.args.get('with_total', type=int) else None
+    try:
+        keywords, next_cursor = keyset_page(query, BlockedKeyword.added_at, BlockedKeyword.id, cursor, per_page)
+    except InvalidCursor:
+        return jsonify({'error': '无效的分页游标'}), 400
     return jsonify({
         'total': total,
-        'page': page,
         'per_page': per_page,
-        'total_pages': (total + per_page - 1) // per_page,
+        'next_cursor': next_cursor,
         'keywords': [
             {'id': kw.id, 'keyword': kw.keyword, 'added_at': kw.added_at.isoformat() if kw.added_at else None}
             for kw in keywords
@@ -461,9 +520,9 @@ def api_add_keyword():
                 obj = BlockedKeyword(keyword=k, added_at=now)
                 db.add(obj)
                 added_objs.append(obj)
+            bump_version(db, KEYWORDS_VERSION)
             db.commit()
-            for obj in added_objs:
-                db.refresh(obj)
+            added_objs = db.query(BlockedKeyword).filter(BlockedKeyword.keyword.in_(to_add)).all()
         except IntegrityError:
             db.rollback()
             all_objs = db.query(BlockedKeyword).filter(
@@ -494,6 +553,32 @@ def api_add_keyword():
     }), (201 if added_objs else 200)
 
 
+@app.route('/api/keywords/import', methods=['POST'])
+@login_required
+def api_import_keywords():
+    upload = request.files.get('file')
+    # 表单上传的文件 werkzeug 已落到临时文件；原始请求体先完整读到临时文件，避免边收边写拉长导入时间。
+    stream = upload.stream if upload else tempfile.TemporaryFile()
+    try:
+        if not upload:
+            shutil.copyfileobj(request.stream, stream)
+            stream.seek(0)
+        stats = import_keywords(iter_lines(stream))
+    except Exception as e:
+        return jsonify({'error': f'导入失败: {e}'}), 500
+    finally:
+        stream.close()
+    return jsonify({'success': True, **stats})
+
+
+@app.route('/api/keywords/export')
+@login_required
+def api_export_keywords():
+    filename = f"keywords-{datetime.datetime.now(SH_TZ).strftime('%Y%m%d-%H%M%S')}.txt"
+    return Response(stream_with_context(iter_export()), mimetype='text/plain; charset=utf-8',
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+
 @app.route('/api/keywords/<int:kw_id>', methods=['DELETE'])
 @login_required
 def api_delete_keyword(kw_id):
@@ -501,6 +586,7 @@ def api_delete_keyword(kw_id):
     if not kw:
         return jsonify({'error': '未找到关键词'}), 404
     g.db.delete(kw)
+    bump_version(g.db, KEYWORDS_VERSION)
     g.db.commit()
     return jsonify({'success': True})
 
@@ -508,30 +594,28 @@ def api_delete_keyword(kw_id):
 @app.route('/api/users')
 @login_required
 def api_get_users():
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 10, type=int)
+    per_page = page_size(request.args.get('per_page', type=int))
+    cursor = request.args.get('cursor') or None
     query_str = request.args.get('search', '')
     filter_by = request.args.get('filter', 'all')
     query = g.db.query(User)
     if filter_by == 'blocked':
         query = query.filter_by(is_blocked=True)
-    if query_str:
-        search_term = f"%{query_str}%"
-        query = query.filter(
-            or_(
-                User.id.like(search_term),
-                User.username.like(search_term),
-                User.first_name.like(search_term),
-                User.last_name.like(search_term)
-            )
-        )
-    total = query.count()
-    users = query.order_by(desc(User.last_seen)).offset((page - 1) * per_page).limit(per_page).all()
+    strategy = None
+    if query_str.strip():
+        query, strategy = filter_users(g.db, query, query_str)
+    started = time.perf_counter()
+    total = query.count() if request.args.get('with_total', type=int) else None
+    try:
+        users, next_cursor = keyset_page(query, User.last_seen, User.id, cursor, per_page)
+    except InvalidCursor:
+        return jsonify({'error': '无效的分页游标'}), 400
+    if strategy:
+        log_search(query_str, strategy, len(users), time.perf_counter() - started)
     return jsonify({
         'total': total,
-        'page': page,
         'per_page': per_page,
-        'total_pages': (total + per_page - 1) // per_page,
+        'next_cursor': next_cursor,
         'users': [
             {
                 'id': u.id,
@@ -555,7 +639,9 @@ def api_block_user(user_id):
     user = g.db.get(User, user_id)
     if not user:
         return jsonify({'error': '未找到用户'}), 404
-    user.is_blocked = True
+    if user.is_blocked != True:
+        user.is_blocked = True
+        bump_version(g.db, BLOCKED_VERSION)
     g.db.commit()
     return jsonify({'success': True, 'is_blocked': True})
 
@@ -566,7 +652,9 @@ def api_unblock_user(user_id):
     user = g.db.get(User, user_id)
     if not user:
         return jsonify({'error': '未找到用户'}), 404
-    user.is_blocked = False
+    if user.is_blocked != False:
+        user.is_blocked = False
+        bump_version(g.db, BLOCKED_VERSION)
     g.db.commit()
     return jsonify({'success': True, 'is_blocked': False})
 
@@ -575,8 +663,8 @@ def api_unblock_user(user_id):
 @login_required
 def api_user_messages():
     user_id = request.args.get('user_id', type=int)
-    page = request.args.get('page', 1, type=int)
-    per_page = 15
+    per_page = page_size(request.args.get('per_page', type=int), 15)
+    cursor = request.args.get('cursor') or None
     search = request.args.get('search', '', type=str).strip()
     start_date = request.args.get('start', '', type=str)
     end_date = request.args.get('end', '', type=str)
@@ -584,35 +672,99 @@ def api_user_messages():
         return jsonify({'error': '缺少 user_id'}), 400
     q = g.db.query(SentMessage).filter(SentMessage.user_id == user_id)
     if search:
-        q = q.filter(SentMessage.message_text.like(f"%{search}%"))
+        q = filter_messages(q, search, uses_fts(g.db, search, user_id))
+    start_dt = end_dt = None
     if start_date:
         try:
-            dt = datetime.datetime.fromisoformat(start_date).astimezone(ZoneInfo('UTC'))
-            q = q.filter(SentMessage.sent_at >= dt)
+            start_dt = datetime.datetime.fromisoformat(start_date).astimezone(ZoneInfo('UTC'))
+            q = q.filter(SentMessage.sent_at >= start_dt)
         except:
             pass
     if end_date:
         try:
-            dt = datetime.datetime.fromisoformat(end_date).astimezone(ZoneInfo('UTC'))
-            q = q.filter(SentMessage.sent_at <= dt)
+            end_dt = datetime.datetime.fromisoformat(end_date).astimezone(ZoneInfo('UTC'))
+            q = q.filter(SentMessage.sent_at <= end_dt)
         except:
             pass
-    total = q.count()
-    msgs = q.order_by(desc(SentMessage.sent_at)) \
-        .offset((page - 1) * per_page) \
-        .limit(per_page).all()
+    include_archive = request.args.get('include_archive', type=int)
+    total = q.count() if request.args.get('with_total', type=int) and not include_archive else None
+    try:
+        if cursor and cursor.startswith(ARCHIVE_CURSOR_PREFIX):
+            msgs, next_cursor = [], None
+            archive_cursor = cursor[len(ARCHIVE_CURSOR_PREFIX):]
+            archive_after = decode_cursor(archive_cursor) if archive_cursor else None
+        else:
+            msgs, next_cursor = keyset_page(q, SentMessage.sent_at, SentMessage.pk_id, cursor, per_page)
+            archive_after = None
+    except InvalidCursor:
+        return jsonify({'error': '无效的分页游标'}), 400
+    messages = [
+        {
+            'text': m.message_text,
+            'highlighted': highlight(m.message_text, search),
+            'sent_at': m.sent_at.isoformat() if m.sent_at else None
+        }
+        for m in msgs
+    ]
+    if include_archive and next_cursor is None and len(messages) == per_page:
+        next_cursor = ARCHIVE_CURSOR_PREFIX
+    elif include_archive and next_cursor is None:
+        archived, has_more = search_archive(user_id, search, start_dt, end_dt, archive_after,
+                                            per_page - len(messages))
+        messages += [
+            {
+                'text': row['text'],
+                'highlighted': highlight(row['text'], search),
+                'sent_at': row['sent_at'].isoformat(),
+                'archived': True
+            }
+            for row in archived
+        ]
+        if has_more:
+            last = archived[-1]
+            next_cursor = ARCHIVE_CURSOR_PREFIX + encode_cursor(last['sent_at'], last['pk_id'])
     return jsonify({
         'total': total,
+        'per_page': per_page,
+        'next_cursor': next_cursor,
+        'messages': messages
+    })
+
+
+@app.route('/api/search_messages')
+@login_required
+def api_search_messages():
+    search = request.args.get('q', '', type=str).strip()
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = 20
+    if not search:
+        return jsonify({'error': '缺少搜索内容'}), 400
+    q = g.db.query(SentMessage, User.username, User.first_name) \
+        .outerjoin(User, User.id == SentMessage.user_id)
+    ranked = uses_fts(g.db, search)
+    q = filter_messages(q, search, ranked)
+    if ranked:
+        q = q.add_columns(snippet_column()).order_by(rank_column())
+    else:
+        q = q.order_by(desc(SentMessage.sent_at))
+    rows = q.offset((page - 1) * per_page).limit(per_page + 1).all()
+    results = []
+    for row in rows[:per_page]:
+        m, username, first_name = row[:3]
+        results.append({
+            'user_id': m.user_id,
+            'username': username,
+            'first_name': first_name,
+            'text': m.message_text,
+            'snippet': row[3] if ranked else highlight(m.message_text, search),
+            'sent_at': m.sent_at.isoformat() if m.sent_at else None
+        })
+    return jsonify({
         'page': page,
         'per_page': per_page,
-        'total_pages': (total + per_page - 1) // per_page,
-        'messages': [
-            {
-                'text': m.message_text,
-                'sent_at': m.sent_at.isoformat() if m.sent_at else None
-            }
-            for m in msgs
-        ]
+        'has_more': len(rows) > per_page,
+        'ranked': ranked,
+        'messages': results
     })
 
 
@@ -624,6 +776,7 @@ def api_verify_user(user_id):
         return jsonify({'error': '未找到用户'}), 404
     user.is_verified = True
     user.verified_at = datetime.datetime.now(ZoneInfo('UTC'))
+    bump_version(g.db, USERS_VERSION)
     g.db.commit()
     return jsonify({'success': True, 'is_verified': True})
 
@@ -636,62 +789,26 @@ def api_unverify_user(user_id):
         return jsonify({'error': '未找到用户'}), 404
     user.is_verified = False
     user.verified_at = None
+    bump_version(g.db, USERS_VERSION)
     g.db.commit()
     return jsonify({'success': True, 'is_verified': False})
 
 
-bot_process = None
-
-
-def is_bot_running():
-    for p in psutil.process_iter(['pid', 'cmdline']):
-        try:
-            cmd = p.info['cmdline']
-            if cmd and 'bot.py' in " ".join(cmd):
-                return True
-        except:
-            pass
-    return False
-
-
-def start_bot():
-    global bot_process
-    if not is_bot_running():
-        print("[INFO] 正在启动 Telegram Bot（bot.py）...")
-        bot_process = subprocess.Popen(
-            [sys.executable, "bot.py"],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
-    else:
-        print("[INFO] bot.py 已在运行，无需重复启动。")
-
-
-def stop_bot():
-    global bot_process
-    if bot_process and bot_process.poll() is None:
-        print("[INFO] 正在停止 bot.py...")
-        try:
-            bot_process.terminate()
-        except:
-            pass
-    for p in psutil.process_iter(['pid', 'cmdline']):
-        try:
-            if 'bot.py' in " ".join(p.info['cmdline']):
-                p.kill()
-        except:
-            pass
-    print("[INFO] bot.py 已停止。")
+BOT_SUPERVISOR = BotSupervisor([sys.executable, "bot.py"])
 
 
-def restart_bot():
-    stop_bot()
-    start_bot()
+@app.route('/api/bot_status')
+@login_required
+def api_bot_status():
+    return jsonify(BOT_SUPERVISOR.status())
 
 
-atexit.register(stop_bot)
+atexit.register(BOT_SUPERVISOR.stop)
 
 if __name__ == "__main__":
+    logging.basicConfig(
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+    )
     host = "0.0.0.0"
     port = 8080
     if not is_configured():
@@ -700,7 +817,7 @@ if __name__ == "__main__":
         print(f"请在浏览器中打开 http://{host}:{port}/setup 完成设置。")
         print("=" * 50)
     else:
-        start_bot()
+        BOT_SUPERVISOR.start()
         app.secret_key = get_config().get('SECRET_KEY', os.urandom(24))
         print("=" * 50)
         print("Web 面板已启动。")
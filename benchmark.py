@@ -0,0 +1,429 @@
+import argparse
+import asyncio
+import datetime
+import os
+import random
+import string
+import tempfile
+import time
+
+from keyword_matcher import KeywordMatcher
+
+CJK_CHARS = [chr(c) for c in range(0x4e00, 0x4e00 + 3000)]
+
+
+def _random_word(rng, min_len, max_len):
+    length = rng.randint(min_len, max_len)
+    if rng.random() < 0.5:
+        return ''.join(rng.choices(CJK_CHARS, k=length))
+    return ''.join(rng.choices(string.ascii_lowercase, k=length))
+
+
+def _naive_check(keywords, text):
+    text_lower = text.lower()
+    for kw in keywords:
+        if kw.lower() in text_lower:
+            return kw
+    return None
+
+
+def bench_keywords(args):
+    rng = random.Random(42)
+    messages = [_random_word(rng, 50, 300) for _ in range(args.messages)]
+    print(f"{'keywords':>10} {'build(s)':>10} {'loop(ms/msg)':>14} {'matcher(ms/msg)':>16} {'speedup':>9}")
+    for size in args.sizes:
+        keywords = list({_random_word(rng, 2, 8) for _ in range(size)})
+
+        t0 = time.perf_counter()
+        matcher = KeywordMatcher(keywords)
+        build = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        naive_hits = sum(1 for m in messages if _naive_check(keywords, m))
+        naive = (time.perf_counter() - t0) / len(messages) * 1000
+
+        t0 = time.perf_counter()
+        matcher_hits = sum(1 for m in messages if matcher.find_all(m))
+        compiled = (time.perf_counter() - t0) / len(messages) * 1000
+
+        assert naive_hits == matcher_hits
+        print(f"{size:>10} {build:>10.3f} {naive:>14.3f} {compiled:>16.3f} {naive / compiled:>8.1f}x")
+
+
+def _use_temp_database():
+    workdir = tempfile.mkdtemp(prefix='tgbot-bench-')
+    os.chdir(workdir)
+    import database
+    database.init_db()
+    return database
+
+
+def bench_db_concurrency(args):
+    database = _use_temp_database()
+    from sqlalchemy import insert, func
+    db = database.SessionLocal()
+    db.execute(insert(database.SentMessage), [
+        {'user_id': i % 1000, 'message_text': f'message {i}', 'sent_at': None} for i in range(args.rows)
+    ])
+    db.commit()
+    db.close()
+
+    def handler_db_work(user_id):
+        session = database.SessionLocal()
+        try:
+            return session.query(func.count(database.SentMessage.pk_id)).filter(
+                database.SentMessage.message_text.like(f'%{user_id}%')
+            ).scalar()
+        finally:
+            session.close()
+
+    async def handler(mode, user_id):
+        if mode == 'inline':
+            handler_db_work(user_id)
+        else:
+            await database.run_db(handler_db_work, user_id)
+        await asyncio.sleep(args.io_ms / 1000)
+
+    async def run(mode, concurrency):
+        sem = asyncio.Semaphore(concurrency)
+        stall = 0.0
+        done = False
+
+        async def ticker():
+            nonlocal stall
+            loop = asyncio.get_running_loop()
+            while not done:
+                before = loop.time()
+                await asyncio.sleep(0.001)
+                stall = max(stall, loop.time() - before - 0.001)
+
+        async def limited(i):
+            async with sem:
+                await handler(mode, i)
+
+        tick = asyncio.create_task(ticker())
+        start = time.perf_counter()
+        await asyncio.gather(*(limited(i) for i in range(args.updates)))
+        elapsed = time.perf_counter() - start
+        done = True
+        await tick
+        return args.updates / elapsed, stall * 1000
+
+    print(f"rows={args.rows} updates={args.updates} simulated telegram I/O={args.io_ms}ms "
+          f"db workers={database.DB_EXECUTOR_WORKERS} cpus={os.cpu_count()}")
+    print(f"{'concurrency':>12} {'inline(upd/s)':>14} {'stall(ms)':>10} {'executor(upd/s)':>16} {'stall(ms)':>10}")
+    for concurrency in args.concurrency:
+        inline, inline_stall = asyncio.run(run('inline', concurrency))
+        executor, executor_stall = asyncio.run(run('executor', concurrency))
+        print(f"{concurrency:>12} {inline:>14.1f} {inline_stall:>10.1f} {executor:>16.1f} {executor_stall:>10.1f}")
+
+
+def bench_captcha(args):
+    from captcha_pool import CaptchaPool, captcha_length, render_captcha
+
+    def inline():
+        start = time.perf_counter()
+        for _ in range(args.requests):
+            render_captcha(captcha_length(args.difficulty))
+        return time.perf_counter() - start
+
+    async def pooled():
+        pool = CaptchaPool(size=args.requests, workers=args.workers)
+        pool.start()
+        try:
+            await pool.refill([args.difficulty])
+            start = time.perf_counter()
+            for _ in range(args.requests):
+                await pool.take(args.difficulty)
+            return time.perf_counter() - start, pool.stats()
+        finally:
+            pool.stop()
+
+    inline_elapsed = inline()
+    pooled_elapsed, stats = asyncio.run(pooled())
+    print(f"difficulty={args.difficulty} requests={args.requests} workers={args.workers}")
+    print(f"{'inline render(ms/captcha)':>26} {'pool take(ms/captcha)':>22} {'hit rate':>9}")
+    print(f"{inline_elapsed / args.requests * 1000:>26.3f} {pooled_elapsed / args.requests * 1000:>22.3f} "
+          f"{stats['hit_rate']:>9.0%}")
+
+
+def bench_math(args):
+    from math_challenge import generate_challenge
+    print(f"{'difficulty':>10} {'challenges/s':>14} {'us/challenge':>13}")
+    for difficulty in args.difficulties:
+        start = time.perf_counter()
+        for _ in range(args.count):
+            generate_challenge(difficulty)
+        elapsed = time.perf_counter() - start
+        print(f"{difficulty:>10} {args.count / elapsed:>14.0f} {elapsed / args.count * 1e6:>13.1f}")
+
+
+def _contention_worker(role, url, tuned, seconds, results):
+    import datetime
+    from sqlalchemy import create_engine, event, text
+    from sqlalchemy.exc import OperationalError
+    import database
+
+    engine = create_engine(url, connect_args={'check_same_thread': False})
+    if tuned:
+        event.listen(engine, 'connect', database.set_sqlite_pragmas)
+    rng = random.Random(os.getpid())
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        user_id = rng.randint(1, 1000)
+        now = datetime.datetime.utcnow()
+        start = time.perf_counter()
+        try:
+            with engine.begin() as conn:
+                if role == 'writer':
+                    conn.execute(text("INSERT INTO sent_messages (user_id, message_text, sent_at) VALUES (:u, :t, :s)"),
+                                 {'u': user_id, 't': 'benchmark message', 's': now})
+                    conn.execute(text("UPDATE users SET last_seen = :s WHERE id = :u"), {'u': user_id, 's': now})
+                else:
+                    conn.execute(text("SELECT count(*) FROM sent_messages WHERE sent_at >= :s"),
+                                 {'s': now - datetime.timedelta(days=1)}).scalar()
+                    conn.execute(text("SELECT * FROM sent_messages WHERE user_id = :u ORDER BY sent_at DESC LIMIT 50"),
+                                 {'u': user_id}).fetchall()
+                    conn.execute(text("SELECT * FROM users ORDER BY last_seen DESC LIMIT 20")).fetchall()
+        except OperationalError:
+            errors += 1
+            continue
+        latencies.append(time.perf_counter() - start)
+    results.put((role, latencies, errors))
+
+
+def bench_db_contention(args):
+    import datetime
+    import multiprocessing
+    from sqlalchemy import create_engine, event, insert
+    import database
+
+    workdir = tempfile.mkdtemp(prefix='tgbot-bench-')
+    print(f"writers={args.writers} readers={args.readers} seconds={args.seconds} rows={args.rows} cpus={os.cpu_count()}")
+    print(f"{'mode':>9} {'writes/s':>9} {'w p99(ms)':>10} {'reads/s':>8} {'r p99(ms)':>10} {'locked errors':>14}")
+    for tuned in (False, True):
+        url = f"sqlite:///{os.path.join(workdir, 'tuned.db' if tuned else 'baseline.db')}"
+        engine = create_engine(url)
+        if tuned:
+            event.listen(engine, 'connect', database.set_sqlite_pragmas)
+        database.Base.metadata.create_all(engine)
+        now = datetime.datetime.utcnow()
+        with engine.begin() as conn:
+            conn.execute(insert(database.User), [{'id': i, 'last_seen': now} for i in range(1, 1001)])
+            conn.execute(insert(database.SentMessage), [
+                {'user_id': i % 1000 + 1, 'message_text': f'message {i}', 'sent_at': now - datetime.timedelta(minutes=i)}
+                for i in range(args.rows)
+            ])
+        engine.dispose()
+
+        results = multiprocessing.Queue()
+        roles = ['writer'] * args.writers + ['reader'] * args.readers
+        procs = [multiprocessing.Process(target=_contention_worker, args=(role, url, tuned, args.seconds, results))
+                 for role in roles]
+        for proc in procs:
+            proc.start()
+        collected = [results.get() for _ in procs]
+        for proc in procs:
+            proc.join()
+
+        stats = {}
+        for role in ('writer', 'reader'):
+            latencies = sorted(l for r, ls, _ in collected if r == role for l in ls)
+            p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000 if latencies else 0.0
+            stats[role] = (len(latencies) / args.seconds, p99)
+        errors = sum(e for _, _, e in collected)
+        print(f"{'tuned' if tuned else 'baseline':>9} {stats['writer'][0]:>9.0f} {stats['writer'][1]:>10.1f} "
+              f"{stats['reader'][0]:>8.0f} {stats['reader'][1]:>10.1f} {errors:>14}")
+
+
+def bench_search(args):
+    database = _use_temp_database()
+    from sqlalchemy import insert, desc
+    from message_search import filter_messages, uses_fts, snippet_column, rank_column
+
+    rng = random.Random(7)
+    vocabulary = [_random_word(rng, 2, 6) for _ in range(20000)]
+    terms = [word for word in vocabulary if len(word) >= 3]
+    db = database.SessionLocal()
+    start = time.perf_counter()
+    for offset in range(0, args.rows, 50000):
+        db.execute(insert(database.SentMessage), [
+            {'user_id': rng.randint(1, args.users), 'message_text': ' '.join(rng.choices(vocabulary, k=12)),
+             'sent_at': None}
+            for _ in range(min(50000, args.rows - offset))
+        ])
+        db.commit()
+    print(f"rows={args.rows} users={args.users} fts={uses_fts(db, 'abc')} "
+          f"load+index={time.perf_counter() - start:.1f}s")
+
+    def timed(build):
+        samples = []
+        for _ in range(args.queries):
+            term = rng.choice(terms)
+            t0 = time.perf_counter()
+            build(term).all()
+            samples.append(time.perf_counter() - t0)
+        samples.sort()
+        return samples[len(samples) // 2] * 1000, samples[int(len(samples) * 0.95) - 1] * 1000
+
+    def per_user_fts(term):
+        user_id = rng.randint(1, args.users)
+        q = db.query(database.SentMessage).filter(database.SentMessage.user_id == user_id)
+        q = filter_messages(q, term, uses_fts(db, term, user_id))
+        return q.order_by(desc(database.SentMessage.sent_at)).limit(15)
+
+    def per_user_like(term):
+        return db.query(database.SentMessage).filter(
+            database.SentMessage.user_id == rng.randint(1, args.users),
+            database.SentMessage.message_text.like(f"%{term}%")
+        ).order_by(desc(database.SentMessage.sent_at)).limit(15)
+
+    def global_fts(term):
+        q = filter_messages(db.query(database.SentMessage), term, True)
+        return q.add_columns(snippet_column()).order_by(rank_column()).limit(20)
+
+    def global_like(term):
+        return db.query(database.SentMessage).filter(
+            database.SentMessage.message_text.like(f"%{term}%")
+        ).order_by(desc(database.SentMessage.sent_at)).limit(20)
+
+    print(f"{'query':>16} {'p50(ms)':>9} {'p95(ms)':>9}")
+    for name, build in (('per-user LIKE', per_user_like), ('per-user auto', per_user_fts),
+                        ('global LIKE', global_like), ('global FTS', global_fts)):
+        p50, p95 = timed(build)
+        print(f"{name:>16} {p50:>9.1f} {p95:>9.1f}")
+    db.close()
+
+
+def bench_user_search(args):
+    database = _use_temp_database()
+    from sqlalchemy import insert, or_
+    from pagination import keyset_page
+    from user_search import filter_users
+
+    User = database.User
+    rng = random.Random(11)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    db = database.SessionLocal()
+    start = time.perf_counter()
+    users = []
+    for offset in range(0, args.users, 50000):
+        batch = [
+            {'id': 10 ** 9 + offset + i, 'username': _random_word(rng, 5, 12), 'first_name': _random_word(rng, 3, 8),
+             'last_name': ''.join(rng.choices(CJK_CHARS, k=2)),
+             'last_seen': now - datetime.timedelta(seconds=rng.randint(0, 90 * 86400))}
+            for i in range(min(50000, args.users - offset))
+        ]
+        db.execute(insert(User), batch)
+        db.commit()
+        users.extend(rng.sample(batch, min(len(batch), 200)))
+    print(f"users={args.users} load+index={time.perf_counter() - start:.1f}s")
+
+    kinds = {
+        'id': lambda u: str(u['id']),
+        '@prefix': lambda u: '@' + u['username'][:3],
+        'name': lambda u: u['first_name'][1:4],
+        'cjk': lambda u: u['last_name'][:2],
+    }
+
+    def old_filter(query, term):
+        pattern = f"%{term}%"
+        return query.filter(or_(User.id.like(pattern), User.username.like(pattern),
+                                User.first_name.like(pattern), User.last_name.like(pattern)))
+
+    def new_filter(query, term):
+        return filter_users(db, query, term)[0]
+
+    print(f"{'query':>10} {'old p50':>9} {'new p50':>9} {'new p95':>9}  (ms)")
+    for kind, make_term in kinds.items():
+        row = []
+        for apply in (old_filter, new_filter):
+            samples = []
+            for _ in range(args.queries):
+                term = make_term(rng.choice(users))
+                t0 = time.perf_counter()
+                query = apply(db.query(User), term)
+                query.count()
+                keyset_page(query, User.last_seen, User.id, None, 20)
+                samples.append(time.perf_counter() - t0)
+            samples.sort()
+            row.append((samples[len(samples) // 2] * 1000, samples[int(len(samples) * 0.95) - 1] * 1000))
+        print(f"{kind:>10} {row[0][0]:>9.1f} {row[1][0]:>9.1f} {row[1][1]:>9.1f}")
+    db.close()
+
+
+def bench_keyword_import(args):
+    _use_temp_database()
+    from keyword_io import import_keywords, iter_lines, iter_export
+
+    rng = random.Random(5)
+    path = os.path.join(os.getcwd(), 'keywords.txt')
+    with open(path, 'w', encoding='utf-8') as f:
+        for i in range(args.keywords):
+            f.write(f"{_random_word(rng, 2, 6)}{i}\n")
+    for label in ('fresh', 'all existing'):
+        with open(path, 'rb') as f:
+            stats = import_keywords(iter_lines(f))
+        print(f"{label:>13}: added={stats['added']} existing={stats['existing']} in {stats['elapsed']:.2f}s")
+    start = time.perf_counter()
+    exported = sum(chunk.count('\n') for chunk in iter_export())
+    print(f"{'export':>13}: {exported} keywords in {time.perf_counter() - start:.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TGBot 性能基准测试")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('keywords', help="关键词匹配：逐个子串扫描 vs Aho-Corasick")
+    p.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    p.add_argument('--messages', type=int, default=200)
+    p.set_defaults(func=bench_keywords)
+
+    p = sub.add_parser('db-concurrency', help="并发更新吞吐：事件循环内同步查询 vs DB 线程池")
+    p.add_argument('--rows', type=int, default=20000)
+    p.add_argument('--updates', type=int, default=200)
+    p.add_argument('--io-ms', type=int, default=50)
+    p.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16, 64])
+    p.set_defaults(func=bench_db_concurrency)
+
+    p = sub.add_parser('captcha', help="图片验证码签发延迟：事件循环内渲染 vs 预生成池")
+    p.add_argument('--difficulty', default='hell', choices=['easy', 'medium', 'hard', 'hell'])
+    p.add_argument('--requests', type=int, default=50)
+    p.add_argument('--workers', type=int, default=2)
+    p.set_defaults(func=bench_captcha)
+
+    p = sub.add_parser('math', help="数学验证题生成速度")
+    p.add_argument('--difficulties', nargs='+', default=['easy', 'medium', 'hard', 'hell'])
+    p.add_argument('--count', type=int, default=5000)
+    p.set_defaults(func=bench_math)
+
+    p = sub.add_parser('db-contention', help="机器人写入 + 面板读取的多进程争用：默认日志模式 vs WAL 调优")
+    p.add_argument('--writers', type=int, default=2)
+    p.add_argument('--readers', type=int, default=4)
+    p.add_argument('--seconds', type=float, default=5)
+    p.add_argument('--rows', type=int, default=50000)
+    p.set_defaults(func=bench_db_contention)
+
+    p = sub.add_parser('search', help="聊天记录搜索：LIKE 扫描 vs FTS5 trigram 索引")
+    p.add_argument('--rows', type=int, default=1000000)
+    p.add_argument('--users', type=int, default=5000)
+    p.add_argument('--queries', type=int, default=50)
+    p.set_defaults(func=bench_search)
+
+    p = sub.add_parser('user-search', help="用户搜索：四列 LIKE 扫描 vs ID/前缀/三元组索引")
+    p.add_argument('--users', type=int, default=500000)
+    p.add_argument('--queries', type=int, default=20)
+    p.set_defaults(func=bench_user_search)
+
+    p = sub.add_parser('keyword-import', help="关键词批量导入（INSERT OR IGNORE 分批）与流式导出")
+    p.add_argument('--keywords', type=int, default=1000000)
+    p.set_defaults(func=bench_keyword_import)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,24 @@
+import asyncio
+import contextlib
 import logging
 import random
 import string
+import threading
+from collections import OrderedDict
 import datetime
 import json
 import os
 import time
 import io
-from fractions import Fraction
+import tempfile
 from zoneinfo import ZoneInfo
 from html import escape as escape_html
-from captcha.image import ImageCaptcha
 from dateutil.relativedelta import relativedelta
 
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton, Bot, Message
 from telegram.ext import (
     Application,
+    BaseUpdateProcessor,
     CommandHandler,
     MessageHandler,
     CallbackQueryHandler,
@@ -23,8 +27,23 @@ from telegram.ext import (
 )
 from telegram.constants import ParseMode, ChatType
 from telegram.helpers import escape_markdown
+from sqlalchemy import update, desc, inspect as sa_inspect
+from sqlalchemy.orm import make_transient_to_detached
 
-from database import SessionLocal, User, BlockedKeyword, init_db, SentMessage, StartMessage, Config
+from database import (
+    SessionLocal, User, BlockedKeyword, init_db, StartMessage, Config, bump_version, get_versions,
+    run_db, KEYWORDS_VERSION, CONFIG_VERSION, BLOCKED_VERSION, USERS_VERSION
+)
+from keyword_matcher import KeywordMatcher
+from message_writer import MessageWriter
+from captcha_pool import CaptchaPool
+from math_challenge import generate_challenge, answer_options
+from verification_store import VerificationStore, save_verifications, load_verifications
+from daily_stats import DailyStatsBuffer, write_daily_stats, load_dialog_users, sh_day
+from message_map import ReplyTargetCache, load_mapped_user_id, retention_bounds, delete_expired_batch, \
+    incremental_vacuum
+from message_archive import archive_batch
+from keyword_io import iter_export
 
 DATABASE_FILE = 'bot_data.db'
 
@@ -34,6 +53,24 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 perPage = 5
+KEYWORDS_PER_PAGE = 30
+KEYWORD_DISPLAY_LENGTH = 64
+
+STATE_POLL_INTERVAL = 3
+USER_FLUSH_INTERVAL = 30
+STATS_FLUSH_INTERVAL = 30
+SLOW_PIPELINE_SECONDS = 2.0
+DEFAULT_MAX_CONCURRENT_UPDATES = 16
+CAPTCHA_REFILL_INTERVAL = 5
+VERIFICATION_SWEEP_INTERVAL = 30
+VERIFICATION_STORE_SIZE = 10000
+PERSIST_VERIFICATIONS = True
+REPLY_TARGET_CACHE_SIZE = 20000
+USER_CACHE_SIZE = 50000
+RETENTION_INTERVAL = 3600
+RETENTION_BATCH_SIZE = 5000
+RETENTION_MAX_BATCHES = 100
+VACUUM_PAGES_PER_RUN = 2000
 
 SH_TZ = ZoneInfo('Asia/Shanghai')
 
@@ -63,23 +100,194 @@ def load_db_config():
         'VERIFICATION_EXPIRY_VALUE': c.verification_expiry_value,
         'UPDATE_METHOD': c.update_method,
         'WEBHOOK_DOMAIN': c.webhook_domain,
-        'WEBHOOK_SECRET': c.webhook_secret
+        'WEBHOOK_SECRET': c.webhook_secret,
+        'MAX_CONCURRENT_UPDATES': c.max_concurrent_updates,
+        'MESSAGE_MAP_MAX_AGE_DAYS': c.message_map_max_age_days,
+        'MESSAGE_MAP_MAX_ROWS': c.message_map_max_rows,
+        'MESSAGE_RETENTION_DAYS': c.message_retention_days
     }
 
 
-VERIFICATION_DATA = {}
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """不同用户的更新并发处理，同一用户的更新按到达顺序串行执行。
+
+    先排队拿到该用户的锁，再占用全局并发名额：同一用户积压的更新不会占满名额、拖慢其他用户。
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self._user_locks = {}
+
+    @staticmethod
+    def ordering_key(update):
+        if isinstance(update, Update):
+            if update.effective_user:
+                return update.effective_user.id
+            if update.effective_chat:
+                return update.effective_chat.id
+        return None
+
+    async def process_update(self, update, coroutine):
+        key = self.ordering_key(update)
+        if key is None:
+            await super().process_update(update, coroutine)
+            return
+        entry = self._user_locks.get(key)
+        if entry is None:
+            entry = self._user_locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await super().process_update(update, coroutine)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._user_locks[key]
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+
+class ConfigCache:
+    def __init__(self):
+        self.config = None
+        self.version = None
+
+    def reload(self):
+        db = SessionLocal()
+        try:
+            version = get_versions(db).get(CONFIG_VERSION, 0)
+        finally:
+            db.close()
+        self.config = load_db_config()
+        self.version = version
+
+
+BOT_CONFIG_CACHE = ConfigCache()
+
+
+def get_bot_config():
+    if BOT_CONFIG_CACHE.config is None:
+        BOT_CONFIG_CACHE.reload()
+    return BOT_CONFIG_CACHE.config
+
+
+VERIFICATION_STORE = VerificationStore(max_size=VERIFICATION_STORE_SIZE)
+
+
+class UserActivityBuffer:
+    def __init__(self):
+        self.last_seen = {}
+        self._lock = threading.Lock()
 
+    def mark_seen(self, user_id, seen_at):
+        with self._lock:
+            self.last_seen[user_id] = seen_at
 
-def get_or_create_user(session, user_data: dict):
+    def discard_seen(self, user_id):
+        with self._lock:
+            self.last_seen.pop(user_id, None)
+
+    def take_pending(self):
+        with self._lock:
+            pending, self.last_seen = self.last_seen, {}
+        return pending
+
+    def restore(self, pending):
+        with self._lock:
+            for user_id, seen_at in pending.items():
+                self.last_seen.setdefault(user_id, seen_at)
+
+
+class UserProfileCache:
+    """Telegram id → (资料, is_blocked, is_verified, verified_at) 的 LRU，资料未变的老用户转发时不必读库。
+
+    网页面板修改屏蔽或验证状态会递增版本号，轮询到变化时整体清空。
+    """
+
+    def __init__(self, max_size=USER_CACHE_SIZE):
+        self.max_size = max_size
+        self.version = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def entry(user: User):
+        return (user.username, user.first_name, user.last_name, user.lang_code), \
+            user.is_blocked, user.is_verified, user.verified_at
+
+    def get(self, user_id, profile):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] != profile:
+                return None
+            self._entries.move_to_end(user_id)
+            return entry
+
+    def put(self, user_id, entry):
+        with self._lock:
+            self._entries[user_id] = entry
+            self._entries.move_to_end(user_id)
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def discard(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self, version=None):
+        with self._lock:
+            self._entries.clear()
+            self.version = version
+
+
+USER_ACTIVITY = UserActivityBuffer()
+USER_CACHE = UserProfileCache()
+DAILY_STATS = DailyStatsBuffer()
+
+
+def user_profile(user_data: dict):
+    return (
+        user_data.get('username'),
+        user_data.get('first_name'),
+        user_data.get('last_name'),
+        user_data.get('language_code'),
+    )
+
+
+def cached_user_for_update(user_data: dict):
+    """命中缓存时构造一个已脱离会话的 User，之后的修改仍由 save_user 以 UPDATE 写回。"""
+    entry = USER_CACHE.get(user_data['id'], user_profile(user_data))
+    if entry is None:
+        return None
+    (username, first_name, last_name, lang_code), is_blocked, is_verified, verified_at = entry
+    user = User(id=user_data['id'], username=username, first_name=first_name, last_name=last_name,
+                lang_code=lang_code, is_blocked=is_blocked, is_verified=is_verified, verified_at=verified_at)
+    make_transient_to_detached(user)
+    USER_ACTIVITY.mark_seen(user.id, now_utc())
+    return user
+
+
+def get_or_create_user(session, user_data: dict, commit=True):
     user = session.get(User, user_data['id'])
     now = now_utc()
+    profile = user_profile(user_data)
 
     if user:
-        user.username = user_data.get('username')
-        user.first_name = user_data.get('first_name')
-        user.last_name = user_data.get('last_name')
-        user.lang_code = user_data.get('language_code')
-        user.last_seen = now
+        if (user.username, user.first_name, user.last_name, user.lang_code) != profile:
+            user.username, user.first_name, user.last_name, user.lang_code = profile
+            user.last_seen = now
+            if commit:
+                session.commit()
+            USER_ACTIVITY.discard_seen(user.id)
+        else:
+            USER_ACTIVITY.mark_seen(user.id, now)
     else:
         user = User(
             id=user_data['id'],
@@ -93,61 +301,315 @@ def get_or_create_user(session, user_data: dict):
             last_seen=now
         )
         session.add(user)
+        if commit:
+            session.commit()
+            DAILY_STATS.incr('new_users')
 
-    session.commit()
     return user
 
 
-def get_user_from_db(session, user_id: int):
-    return session.get(User, user_id)
+def write_last_seen(pending: dict):
+    if not pending:
+        return
+    db_session = SessionLocal()
+    try:
+        db_session.execute(
+            update(User),
+            [{'id': user_id, 'last_seen': seen_at} for user_id, seen_at in pending.items()]
+        )
+        db_session.commit()
+    finally:
+        db_session.close()
+
 
+async def flush_user_activity(context: ContextTypes.DEFAULT_TYPE = None):
+    pending = USER_ACTIVITY.take_pending()
+    try:
+        await run_db(write_last_seen, pending)
+    except Exception as e:
+        logger.error(f"Failed to flush last_seen for {len(pending)} users: {e}")
+        USER_ACTIVITY.restore(pending)
 
-def check_keyword(session, text: str):
-    if not text:
-        return None
 
-    keywords = session.query(BlockedKeyword.keyword).all()
-    text_lower = text.lower()
+async def flush_daily_stats(context: ContextTypes.DEFAULT_TYPE = None):
+    pending = DAILY_STATS.take_pending()
+    try:
+        await run_db(write_daily_stats, pending)
+    except Exception as e:
+        logger.error(f"Failed to flush daily stats: {e}")
+        DAILY_STATS.restore(pending)
 
-    for (kw,) in keywords:
-        if kw.lower() in text_lower:
-            return kw
-    return None
 
+class StageTimer:
+    def __init__(self, name):
+        self.name = name
+        self.stages = {}
+        self.started = time.perf_counter()
 
-async def start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user = update.effective_user
-    lang = user.language_code or 'en'
+    @contextlib.contextmanager
+    def stage(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[stage] = self.stages.get(stage, 0.0) + time.perf_counter() - start
+
+    def log(self):
+        total = time.perf_counter() - self.started
+        parts = " ".join(f"{name}={elapsed * 1000:.1f}ms" for name, elapsed in self.stages.items())
+        level = logging.WARNING if total >= SLOW_PIPELINE_SECONDS else logging.DEBUG
+        logger.log(level, f"{self.name} timings: total={total * 1000:.1f}ms {parts}")
+
+
+def load_user(user_id: int):
+    db_session = SessionLocal()
+    try:
+        return db_session.get(User, user_id)
+    finally:
+        db_session.close()
+
+
+def ensure_user(user_data: dict):
+    db_session = SessionLocal()
+    try:
+        user = get_or_create_user(db_session, user_data)
+        db_session.refresh(user)
+        return user
+    finally:
+        db_session.close()
+
+
+def load_user_for_update(user_data: dict):
+    db_session = SessionLocal()
+    try:
+        user = get_or_create_user(db_session, user_data, commit=False)
+        db_session.expunge(user)
+        if not user_has_changes(user):
+            USER_CACHE.put(user.id, USER_CACHE.entry(user))
+        return user
+    finally:
+        db_session.close()
+
+
+def user_has_changes(user: User):
+    state = sa_inspect(user)
+    return state.transient or state.modified
+
+
+def save_user(user: User):
+    user_id, entry, is_new = user.id, USER_CACHE.entry(user), sa_inspect(user).transient
+    db_session = SessionLocal()
+    try:
+        db_session.add(user)
+        db_session.commit()
+    finally:
+        db_session.close()
+    USER_CACHE.put(user_id, entry)
+    if is_new:
+        DAILY_STATS.incr('new_users')
+
+
+def mark_user_verified(user_data: dict):
+    db_session = SessionLocal()
+    try:
+        user = get_or_create_user(db_session, user_data, commit=False)
+        is_new = sa_inspect(user).transient
+        user.is_verified = True
+        user.verified_at = now_utc()
+        db_session.commit()
+    finally:
+        db_session.close()
+    USER_CACHE.discard(user_data['id'])
+    if is_new:
+        DAILY_STATS.incr('new_users')
+
+
+def set_user_blocked(user_id: int, blocked: bool):
     db_session = SessionLocal()
     try:
-        get_or_create_user(db_session, user.to_dict())
+        user = db_session.get(User, user_id)
+        if not user:
+            return False
+        if user.is_blocked != blocked:
+            user.is_blocked = blocked
+            bump_version(db_session, BLOCKED_VERSION)
+        db_session.commit()
+        BLOCKED_COUNT.invalidate()
+        USER_CACHE.discard(user_id)
+        return True
     finally:
         db_session.close()
 
-    from database import StartMessage
 
+class BlockedCountCache:
+    """被屏蔽用户总数的缓存，按 blocked 状态版本失效，翻页时不必每次 COUNT。"""
+
+    def __init__(self):
+        self.count = None
+        self.version = None
+
+    def reload(self):
+        db = SessionLocal()
+        try:
+            self.version = get_versions(db).get(BLOCKED_VERSION, 0)
+            self.count = db.query(User).filter_by(is_blocked=True).count()
+        finally:
+            db.close()
+
+    def get(self):
+        if self.count is None:
+            self.reload()
+        return self.count
+
+    def invalidate(self):
+        self.count = None
+
+
+BLOCKED_COUNT = BlockedCountCache()
+
+
+def load_blocked_page(page, per_page, after_id=None, before_id=None):
+    """按 (is_blocked, id) 索引取一页被屏蔽用户：带锚点时走 keyset，否则按页码 OFFSET。"""
+    db_session = SessionLocal()
+    try:
+        query = db_session.query(User).filter_by(is_blocked=True)
+        if after_id is not None:
+            return query.filter(User.id > after_id).order_by(User.id).limit(per_page).all()
+        if before_id is not None:
+            return query.filter(User.id < before_id).order_by(desc(User.id)).limit(per_page).all()[::-1]
+        return query.order_by(User.id).offset((page - 1) * per_page).limit(per_page).all()
+    finally:
+        db_session.close()
+
+
+class KeywordIndex:
+    def __init__(self):
+        self.matcher = KeywordMatcher()
+        self.version = None
+        self.count = 0
+
+    def reload(self):
+        db = SessionLocal()
+        try:
+            version = get_versions(db).get(KEYWORDS_VERSION, 0)
+            keywords = [kw for (kw,) in db.query(BlockedKeyword.keyword).all()]
+        finally:
+            db.close()
+        self.matcher = KeywordMatcher(keywords)
+        self.version = version
+        self.count = len(keywords)
+        logger.info(f"Keyword index rebuilt: {len(self.matcher)} keywords (version {version}).")
+
+
+KEYWORD_INDEX = KeywordIndex()
+MESSAGE_WRITER = MessageWriter()
+REPLY_TARGETS = ReplyTargetCache(max_size=REPLY_TARGET_CACHE_SIZE)
+CAPTCHA_POOL = CaptchaPool()
+
+
+def check_keyword(text: str):
+    if not text:
+        return []
+    return KEYWORD_INDEX.matcher.find_all(text)
+
+
+def read_versions():
+    db = SessionLocal()
+    try:
+        return get_versions(db)
+    finally:
+        db.close()
+
+
+async def refill_captcha_pool(context: ContextTypes.DEFAULT_TYPE = None):
+    bot_config = get_bot_config()
+    if not bot_config or not bot_config.get('VERIFICATION_ENABLED') or bot_config.get('VERIFICATION_TYPE') != 'image':
+        return
+    await CAPTCHA_POOL.refill([bot_config.get('VERIFICATION_DIFFICULTY', 'easy')])
+    logger.debug(f"Captcha pool stats: {CAPTCHA_POOL.stats()}")
+
+
+async def sweep_verifications(context: ContextTypes.DEFAULT_TYPE = None):
+    removed = VERIFICATION_STORE.sweep()
+    if removed:
+        logger.debug(f"Swept {removed} expired verifications, {len(VERIFICATION_STORE)} pending.")
+    if PERSIST_VERIFICATIONS and VERIFICATION_STORE.dirty:
+        # snapshot 先清除 dirty，保存期间的新改动会重新标记；保存失败则恢复标记，下一轮再写。
+        rows = VERIFICATION_STORE.snapshot()
+        try:
+            await run_db(save_verifications, rows)
+        except Exception:
+            VERIFICATION_STORE.dirty = True
+            raise
+
+
+async def apply_retention(context: ContextTypes.DEFAULT_TYPE = None):
+    bot_config = get_bot_config() or {}
+    bounds = await run_db(retention_bounds, bot_config.get('MESSAGE_MAP_MAX_AGE_DAYS'),
+                          bot_config.get('MESSAGE_MAP_MAX_ROWS'))
+    pruned = 0
+    for _ in range(RETENTION_MAX_BATCHES):
+        batch = await run_db(delete_expired_batch, *bounds, RETENTION_BATCH_SIZE)
+        pruned += batch
+        if batch < RETENTION_BATCH_SIZE:
+            break
+    archived = 0
+    retention_days = bot_config.get('MESSAGE_RETENTION_DAYS')
+    if retention_days:
+        archive_before = now_utc() - datetime.timedelta(days=retention_days)
+        for _ in range(RETENTION_MAX_BATCHES):
+            batch = await run_db(archive_batch, archive_before, RETENTION_BATCH_SIZE)
+            archived += batch
+            if batch < RETENTION_BATCH_SIZE:
+                break
+    free_pages = await run_db(incremental_vacuum, VACUUM_PAGES_PER_RUN)
+    if pruned or archived:
+        logger.info(f"Pruned {pruned} message mappings, archived {archived} messages; "
+                    f"{free_pages} free pages left after incremental vacuum.")
+
+
+async def poll_state_versions(context: ContextTypes.DEFAULT_TYPE):
+    versions = await run_db(read_versions)
+    if versions.get(KEYWORDS_VERSION, 0) != KEYWORD_INDEX.version:
+        await run_db(KEYWORD_INDEX.reload)
+    if versions.get(BLOCKED_VERSION, 0) != BLOCKED_COUNT.version:
+        BLOCKED_COUNT.invalidate()
+    user_version = (versions.get(BLOCKED_VERSION, 0), versions.get(USERS_VERSION, 0))
+    if user_version != USER_CACHE.version:
+        USER_CACHE.clear(user_version)
+    if versions.get(CONFIG_VERSION, 0) != BOT_CONFIG_CACHE.version:
+        await run_db(BOT_CONFIG_CACHE.reload)
+        logger.info(f"Bot configuration reloaded (version {BOT_CONFIG_CACHE.version}).")
+
+
+def load_start_message(lang: str):
     db_session = SessionLocal()
     try:
         msg = db_session.query(StartMessage).filter_by(
             lang="zh" if lang.startswith("zh") else "en"
         ).first()
-
-        text = msg.content if msg else "Welcome."
+        return msg.content if msg else "Welcome."
     finally:
         db_session.close()
 
+
+async def start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    lang = user.language_code or 'en'
+
+    text = await run_db(load_start_message, lang)
+
     await update.message.reply_text(text)
 
     await check_verification_and_forward(update, context)
 
 
-async def prompt_verification_if_needed(db_session, db_user, user_id, lang, context):
-    bot_config = load_db_config()
+async def prompt_verification_if_needed(db_user, user_id, lang, context):
+    bot_config = get_bot_config()
 
     if not bot_config.get('VERIFICATION_ENABLED'):
         db_user.is_verified = True
         db_user.verified_at = now_utc()
-        db_session.commit()
         await context.bot.send_message(user_id, "✅ 管理员已关闭验证，您已自动通过。")
         return
 
@@ -165,7 +627,7 @@ async def prompt_verification_if_needed(db_session, db_user, user_id, lang, cont
 async def send_simple_verification(chat_id: int, lang: str, context: ContextTypes.DEFAULT_TYPE):
     token = ''.join(random.choices(string.ascii_letters + string.digits, k=10))
     expiry = now_sh() + datetime.timedelta(minutes=10)
-    VERIFICATION_DATA[chat_id] = {'type': 'simple', 'token': token, 'expiry': expiry}
+    VERIFICATION_STORE.put(chat_id, {'type': 'simple', 'token': token, 'expiry': expiry})
 
     if lang.startswith('zh'):
         text = "🛡 为了防止骚扰，请点击下方按钮完成验证："
@@ -181,123 +643,12 @@ async def send_simple_verification(chat_id: int, lang: str, context: ContextType
 
 
 async def send_math_verification(chat_id: int, lang: str, difficulty: str, context: ContextTypes.DEFAULT_TYPE):
-    question = ""
-    answer = None
-
-    if difficulty == 'hell':
-        for _ in range(200):
-            nums = [random.randint(1000, 9999) for _ in range(random.randint(5, 7))]
-            ops = ['+', '-', '*', '/']
-            random.shuffle(ops)
-
-            all_ops = ops.copy()
-            while len(all_ops) < len(nums) - 1:
-                all_ops.append(random.choice(ops))
-            random.shuffle(all_ops)
-
-            templates = [
-                f"(({nums[0]} {all_ops[0]} {nums[1]}) {all_ops[1]} ({nums[2]} {all_ops[2]} {nums[3]})) {all_ops[3]} {nums[4]}",
-                f"({nums[0]} {all_ops[0]} ({nums[1]} {all_ops[1]} {nums[2]})) {all_ops[2]} ({nums[3]} {all_ops[3]} {nums[4]})",
-                f"(({nums[0]} {all_ops[0]} {nums[1]}) {all_ops[1]} {nums[2]}) {all_ops[2]} ({nums[3]} {all_ops[3]} {nums[4]})"
-            ]
-
-            if len(nums) >= 6:
-                templates.extend([
-                    f"((({nums[0]} {all_ops[0]} {nums[1]}) {all_ops[1]} {nums[2]}) {all_ops[2]} ({nums[3]} {all_ops[3]} {nums[4]})) {all_ops[4]} {nums[5]}",
-                    f"({nums[0]} {all_ops[0]} (({nums[1]} {all_ops[1]} {nums[2]}) {all_ops[2]} {nums[3]})) {all_ops[3]} ({nums[4]} {all_ops[4]} {nums[5]})"
-                ])
-
-            expr = random.choice(templates)
-
-            try:
-                val = eval(expr)
-                if isinstance(val, (int, float)) and abs(val) < 100000 and val != 0:
-                    if isinstance(val, float):
-                        if val.is_integer():
-                            answer = int(val)
-                        else:
-                            answer = round(val, 2)
-                    else:
-                        answer = val
-                    question = expr + " = ?"
-                    break
-            except:
-                continue
-
-        if not answer:
-            question = f"((6000 + 2000) / 4000) * 3000 - 1000 = ?"
-            answer = 5000
-
-    elif difficulty == 'hard':
-        for _ in range(100):
-            nums = [random.randint(100, 999) for _ in range(4)]
-            ops = ['+', '-', '*', '/']
-            random.shuffle(ops)
-
-            templates = [
-                f"({nums[0]} {ops[0]} {nums[1]}) {ops[1]} ({nums[2]} {ops[2]} {nums[3]})",
-                f"(({nums[0]} {ops[0]} {nums[1]}) {ops[1]} {nums[2]}) {ops[2]} {nums[3]}",
-                f"{nums[0]} {ops[0]} (({nums[1]} {ops[1]} {nums[2]}) {ops[2]} {nums[3]})"
-            ]
-
-            expr = random.choice(templates)
-
-            try:
-                val = eval(expr)
-                if isinstance(val, (int, float)) and abs(val) < 10000 and val != 0:
-                    if isinstance(val, float):
-                        if val.is_integer():
-                            answer = int(val)
-                        else:
-                            answer = round(val, 2)
-                    else:
-                        answer = val
-                    question = expr + " = ?"
-                    break
-            except:
-                continue
-
-        if not answer:
-            question = f"(500 + 200) * 300 / 100 - 50 = ?"
-            answer = 2050
-
-    elif difficulty == 'medium':
-        a = random.randint(10, 99)
-        b = random.randint(10, 99)
-        op = random.choice(['+', '-'])
-        question = f"{a} {op} {b} = ?"
-        answer = a + b if op == '+' else a - b
-
-    else:
-        a = random.randint(1, 9)
-        b = random.randint(1, 9)
-        op = random.choice(['+', '-'])
-        question = f"{a} {op} {b} = ?"
-        answer = a + b if op == '+' else a - b
-
+    question, answer = generate_challenge(difficulty)
     answer_str = str(answer)
-    options = {answer_str}
-
-    while len(options) < 4:
-        if isinstance(answer, float):
-            delta = max(0.5, abs(answer) * 0.1)
-            wrong_ans = round(answer + random.uniform(-delta, delta), 2)
-            if wrong_ans != answer:
-                options.add(str(wrong_ans))
-        else:
-            if abs(answer) >= 1000:
-                wrong_ans = answer + random.randint(-500, 500)
-            elif abs(answer) >= 100:
-                wrong_ans = answer + random.randint(-100, 100)
-            else:
-                wrong_ans = answer + random.randint(-10, 10)
-            if wrong_ans != answer:
-                options.add(str(wrong_ans))
-
-    options_list = sorted(list(options), key=lambda x: float(x))
+    options_list = answer_options(answer)
 
     expiry = now_sh() + datetime.timedelta(minutes=5)
-    VERIFICATION_DATA[chat_id] = {'type': 'math', 'answer': answer_str, 'expiry': expiry}
+    VERIFICATION_STORE.put(chat_id, {'type': 'math', 'answer': answer_str, 'expiry': expiry})
 
     if lang.startswith('zh'):
         text = f"🛡 请计算下面的数学题以完成验证：\n\n{question}"
@@ -311,22 +662,10 @@ async def send_math_verification(chat_id: int, lang: str, difficulty: str, conte
 
 
 async def send_image_verification(chat_id: int, lang: str, difficulty: str, context: ContextTypes.DEFAULT_TYPE):
-    if difficulty == 'hell':
-        length = 10
-    elif difficulty == 'hard':
-        length = 8
-    elif difficulty == 'medium':
-        length = 6
-    else:
-        length = 4
-
-    text = ''.join(random.choices(string.ascii_letters + string.digits, k=length))
-
-    image = ImageCaptcha()
-    data = image.generate(text)
+    text, data = await CAPTCHA_POOL.take(difficulty)
 
     expiry = now_sh() + datetime.timedelta(minutes=5)
-    VERIFICATION_DATA[chat_id] = {'type': 'image', 'answer': text, 'expiry': expiry}
+    VERIFICATION_STORE.put(chat_id, {'type': 'image', 'answer': text, 'expiry': expiry})
 
     if lang.startswith('zh'):
         caption = "🛡 请输入图片中的字符以完成验证（不区分大小写）："
@@ -344,33 +683,25 @@ async def simple_verification_callback(update: Update, context: ContextTypes.DEF
     lang = query.from_user.language_code or 'en'
     token = query.data.split("_")[1]
 
-    stored_data = VERIFICATION_DATA.get(user_id)
+    stored_data = VERIFICATION_STORE.get(user_id)
 
     if (stored_data and
             stored_data['type'] == 'simple' and
             stored_data['token'] == token and
             stored_data['expiry'] > now_sh()):
 
-        db_session = SessionLocal()
-        try:
-            user = get_or_create_user(db_session, query.from_user.to_dict())
-            user.is_verified = True
-            user.verified_at = now_utc()
-            db_session.commit()
-
-            if user_id in VERIFICATION_DATA:
-                del VERIFICATION_DATA[user_id]
+        await run_db(mark_user_verified, query.from_user.to_dict())
+        DAILY_STATS.incr('verifications_passed')
 
-            if lang.startswith('zh'):
-                await query.edit_message_text("✅ 验证通过！现在您可以正常发送消息了。")
-            else:
-                await query.edit_message_text("✅ Verified! You can now send messages normally.")
+        VERIFICATION_STORE.discard(user_id)
 
-        finally:
-            db_session.close()
+        if lang.startswith('zh'):
+            await query.edit_message_text("✅ 验证通过！现在您可以正常发送消息了。")
+        else:
+            await query.edit_message_text("✅ Verified! You can now send messages normally.")
     else:
-        if user_id in VERIFICATION_DATA:
-            del VERIFICATION_DATA[user_id]
+        DAILY_STATS.incr('verifications_failed')
+        VERIFICATION_STORE.discard(user_id)
 
         if lang.startswith('zh'):
             await query.edit_message_text("验证失败或已过期，请重新发送消息以获取验证。")
@@ -387,39 +718,32 @@ async def math_callback_handler(update: Update, context: ContextTypes.DEFAULT_TY
     lang = query.from_user.language_code or 'en'
     answer = query.data.split("_")[1]
 
-    stored_data = VERIFICATION_DATA.get(user_id)
+    stored_data = VERIFICATION_STORE.get(user_id)
 
     if (stored_data and
             stored_data['type'] == 'math' and
             stored_data['expiry'] > now_sh()):
 
         if stored_data['answer'] == answer:
-            db_session = SessionLocal()
-            try:
-                user = get_or_create_user(db_session, query.from_user.to_dict())
-                user.is_verified = True
-                user.verified_at = now_utc()
-                db_session.commit()
+            await run_db(mark_user_verified, query.from_user.to_dict())
+            DAILY_STATS.incr('verifications_passed')
 
-                if user_id in VERIFICATION_DATA:
-                    del VERIFICATION_DATA[user_id]
+            VERIFICATION_STORE.discard(user_id)
 
-                if lang.startswith('zh'):
-                    await query.edit_message_text("✅ 验证通过！现在您可以正常发送消息了。")
-                else:
-                    await query.edit_message_text("✅ Verified! You can now send messages normally.")
-            finally:
-                db_session.close()
+            if lang.startswith('zh'):
+                await query.edit_message_text("✅ 验证通过！现在您可以正常发送消息了。")
+            else:
+                await query.edit_message_text("✅ Verified! You can now send messages normally.")
         else:
             if lang.startswith('zh'):
                 await query.edit_message_text("❌ 回答错误。请重新发送消息获取新题目。")
             else:
                 await query.edit_message_text("❌ Wrong answer. Please send a message again to get a new question.")
-            if user_id in VERIFICATION_DATA:
-                del VERIFICATION_DATA[user_id]
+            DAILY_STATS.incr('verifications_failed')
+            VERIFICATION_STORE.discard(user_id)
     else:
-        if user_id in VERIFICATION_DATA:
-            del VERIFICATION_DATA[user_id]
+        DAILY_STATS.incr('verifications_failed')
+        VERIFICATION_STORE.discard(user_id)
 
         if lang.startswith('zh'):
             await query.edit_message_text("验证失败或已过期，请重新发送消息以获取验证。")
@@ -433,134 +757,151 @@ async def check_verification_and_forward(update: Update, context: ContextTypes.D
     if not message:
         return
 
-    user = update.effective_user
-    lang = user.language_code or 'en'
-    bot_config = load_db_config()
-    db_session = SessionLocal()
+    timer = StageTimer('forward')
+    db_user = None
     try:
-        db_user = get_or_create_user(db_session, user.to_dict())
-
-        if db_user.is_blocked:
-            if lang.startswith('zh'):
-                await message.reply_text("🚫 您已被管理员屏蔽，无法发送消息。")
-            else:
-                await message.reply_text("🚫 You have been blocked by the administrator and cannot send messages.")
-            return
+        user_data = update.effective_user.to_dict()
+        with timer.stage('db_read'):
+            db_user = cached_user_for_update(user_data) or await run_db(load_user_for_update, user_data)
+        await run_forward_pipeline(update, context, db_user, timer)
+    finally:
+        # 验证状态在回复用户之前就已改动，Telegram 调用失败时也要落库，否则用户得重新验证。
+        try:
+            if db_user is not None and user_has_changes(db_user):
+                with timer.stage('db_write'):
+                    await run_db(save_user, db_user)
+        finally:
+            timer.log()
 
-        if db_user.is_verified:
-            unit = bot_config.get('VERIFICATION_EXPIRY_UNIT', 'once')
-            value = bot_config.get('VERIFICATION_EXPIRY_VALUE', 1)
-
-            if unit != 'once' and db_user.verified_at:
-                verified_at_aware = db_user.verified_at.replace(tzinfo=ZoneInfo('UTC'))
-
-                expiry_date = verified_at_aware
-                if unit == 'seconds':
-                    expiry_date += datetime.timedelta(seconds=value)
-                elif unit == 'minutes':
-                    expiry_date += datetime.timedelta(minutes=value)
-                elif unit == 'hours':
-                    expiry_date += datetime.timedelta(hours=value)
-                elif unit == 'days':
-                    expiry_date += datetime.timedelta(days=value)
-                elif unit == 'months':
-                    expiry_date += relativedelta(months=value)
-                elif unit == 'years':
-                    expiry_date += relativedelta(years=value)
-
-                if now_utc() > expiry_date:
-                    db_user.is_verified = False
-                    db_session.commit()
-
-        stored_data = VERIFICATION_DATA.get(user.id)
-        if (stored_data and
-                stored_data['type'] == 'image' and
-                stored_data['expiry'] > now_sh() and
-                message.text):
-
-            if message.text.lower() == stored_data['answer'].lower():
-                db_user.is_verified = True
-                db_user.verified_at = now_utc()
-                db_session.commit()
-                del VERIFICATION_DATA[user.id]
-                if lang.startswith('zh'):
-                    await message.reply_text("✅ 验证通过！现在您可以正常发送消息了。")
-                else:
-                    await message.reply_text("✅ Verified! You can now send messages normally.")
-            else:
-                if lang.startswith('zh'):
-                    await message.reply_text("❌ 验证码错误。请重试。")
-                else:
-                    await message.reply_text("❌ CAPTCHA incorrect. Please try again.")
 
-                await send_image_verification(user.id, lang, bot_config.get('VERIFICATION_DIFFICULTY', 'easy'), context)
-            return
+async def run_forward_pipeline(update: Update, context: ContextTypes.DEFAULT_TYPE, db_user: User, timer):
+    message = update.message
+    user = update.effective_user
+    lang = user.language_code or 'en'
+    bot_config = get_bot_config()
 
-        if not db_user.is_verified:
-            await prompt_verification_if_needed(db_session, db_user, user.id, lang, context)
-            if update.message and update.message.text and update.message.text.startswith('/start'):
-                return
+    if db_user.is_blocked:
+        if lang.startswith('zh'):
+            await message.reply_text("🚫 您已被管理员屏蔽，无法发送消息。")
+        else:
+            await message.reply_text("🚫 You have been blocked by the administrator and cannot send messages.")
+        return
 
+    if db_user.is_verified:
+        unit = bot_config.get('VERIFICATION_EXPIRY_UNIT', 'once')
+        value = bot_config.get('VERIFICATION_EXPIRY_VALUE', 1)
+
+        if unit != 'once' and db_user.verified_at:
+            verified_at_aware = db_user.verified_at.replace(tzinfo=ZoneInfo('UTC'))
+
+            expiry_date = verified_at_aware
+            if unit == 'seconds':
+                expiry_date += datetime.timedelta(seconds=value)
+            elif unit == 'minutes':
+                expiry_date += datetime.timedelta(minutes=value)
+            elif unit == 'hours':
+                expiry_date += datetime.timedelta(hours=value)
+            elif unit == 'days':
+                expiry_date += datetime.timedelta(days=value)
+            elif unit == 'months':
+                expiry_date += relativedelta(months=value)
+            elif unit == 'years':
+                expiry_date += relativedelta(years=value)
+
+            if now_utc() > expiry_date:
+                db_user.is_verified = False
+
+    stored_data = VERIFICATION_STORE.get(user.id)
+    if (stored_data and
+            stored_data['type'] == 'image' and
+            stored_data['expiry'] > now_sh() and
+            message.text):
+
+        if message.text.lower() == stored_data['answer'].lower():
+            db_user.is_verified = True
+            db_user.verified_at = now_utc()
+            VERIFICATION_STORE.discard(user.id)
+            DAILY_STATS.incr('verifications_passed')
             if lang.startswith('zh'):
-                await message.reply_text("请先完成验证再发送消息。")
+                await message.reply_text("✅ 验证通过！现在您可以正常发送消息了。")
             else:
-                await message.reply_text("Please complete the verification before sending messages.")
-            return
-
-        if update.message and update.message.text and update.message.text.startswith('/start'):
-            return
-
-        text_to_check = message.text or message.caption
-        hit_keyword = check_keyword(db_session, text_to_check)
-        if hit_keyword:
+                await message.reply_text("✅ Verified! You can now send messages normally.")
+        else:
             if lang.startswith('zh'):
-                await message.reply_text(
-                    f"⚠️ 您的消息包含被屏蔽的关键词 (<code>{escape_html(str(hit_keyword))}</code>)，未被转发给管理员。",
-                    parse_mode=ParseMode.HTML
-                )
+                await message.reply_text("❌ 验证码错误。请重试。")
             else:
-                await message.reply_text(
-                    f"⚠️ Your message contains blocked keywords (<code>{escape_html(str(hit_keyword))}</code>) and was not forwarded to the admin.",
-                    parse_mode=ParseMode.HTML
-                )
+                await message.reply_text("❌ CAPTCHA incorrect. Please try again.")
+            DAILY_STATS.incr('verifications_failed')
 
-            await context.bot.send_message(
-                ADMIN_ID,
-                f"🚫 已拦截来自 {user.mention_html()} (@{user.username} UID: <code>{user.id}</code>) 的消息，命中关键词：<code>{escape_html(str(hit_keyword))}</code>",
-                parse_mode=ParseMode.HTML
-            )
+            await send_image_verification(user.id, lang, bot_config.get('VERIFICATION_DIFFICULTY', 'easy'), context)
+        return
+
+    if not db_user.is_verified:
+        await prompt_verification_if_needed(db_user, user.id, lang, context)
+        if update.message and update.message.text and update.message.text.startswith('/start'):
             return
 
-        try:
-            forwarded_msg = await message.forward(ADMIN_ID)
+        if lang.startswith('zh'):
+            await message.reply_text("请先完成验证再发送消息。")
+        else:
+            await message.reply_text("Please complete the verification before sending messages.")
+        return
 
-            from database import MessageMap
-            db_session.add(MessageMap(admin_msg_id=forwarded_msg.message_id, user_id=user.id))
+    if update.message and update.message.text and update.message.text.startswith('/start'):
+        return
 
-            message_content = message.text or message.caption
-            db_session.add(SentMessage(
-                user_id=user.id,
-                message_text=(message_content[:500] + '...') if message_content and len(
-                    message_content) > 500 else message_content,
-                sent_at=now_utc()
-            ))
+    text_to_check = message.text or message.caption
+    with timer.stage('keyword_check'):
+        hit_keywords = check_keyword(text_to_check)
+    if hit_keywords:
+        DAILY_STATS.incr('blocked_hits')
+        hit_keyword = ', '.join(hit_keywords)
+        if lang.startswith('zh'):
+            await message.reply_text(
+                f"⚠️ 您的消息包含被屏蔽的关键词 (<code>{escape_html(str(hit_keyword))}</code>)，未被转发给管理员。",
+                parse_mode=ParseMode.HTML
+            )
+        else:
+            await message.reply_text(
+                f"⚠️ Your message contains blocked keywords (<code>{escape_html(str(hit_keyword))}</code>) and was not forwarded to the admin.",
+                parse_mode=ParseMode.HTML
+            )
 
-            db_session.commit()
+        await context.bot.send_message(
+            ADMIN_ID,
+            f"🚫 已拦截来自 {user.mention_html()} (@{user.username} UID: <code>{user.id}</code>) 的消息，命中关键词：<code>{escape_html(str(hit_keyword))}</code>",
+            parse_mode=ParseMode.HTML
+        )
+        return
 
-        except Exception as e:
-            logger.error(f"Failed to forward message: {e}")
-            if lang.startswith('zh'):
-                await message.reply_text("抱歉，您的消息未能成功转发给管理员，请稍后再试。")
-            else:
-                await message.reply_text(
-                    "Sorry, your message could not be forwarded to the administrator. Please try again later.")
+    try:
+        with timer.stage('telegram_forward'):
+            forwarded_msg = await message.forward(ADMIN_ID)
+    except Exception as e:
+        logger.error(f"Failed to forward message: {e}")
+        if lang.startswith('zh'):
+            await message.reply_text("抱歉，您的消息未能成功转发给管理员，请稍后再试。")
+        else:
+            await message.reply_text(
+                "Sorry, your message could not be forwarded to the administrator. Please try again later.")
+        return
 
-    finally:
-        db_session.close()
+    message_content = message.text or message.caption
+    REPLY_TARGETS.put(forwarded_msg.message_id, user.id)
+    MESSAGE_WRITER.log_forwarded(
+        forwarded_msg.message_id,
+        user.id,
+        (message_content[:500] + '...') if message_content and len(message_content) > 500 else message_content,
+        now_utc()
+    )
+    DAILY_STATS.record_message(user.id)
 
 
 async def view_blocked_user_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
+    if query.from_user.id != ADMIN_ID:
+        await query.answer("❌ 您没有权限操作。")
+        return
     await query.answer()
 
     user_id_str = query.data.split("_")[-1]
@@ -569,28 +910,27 @@ async def view_blocked_user_callback(update: Update, context: ContextTypes.DEFAU
         return
 
     user_id = int(user_id_str)
-    db_session = SessionLocal()
-    try:
-        user = db_session.get(User, user_id)
-        if not user or not user.is_blocked:
-            await query.edit_message_text("❌ 未找到被屏蔽的用户。")
-            return
+    user = await run_db(load_user, user_id)
+    if not user or not user.is_blocked:
+        await query.edit_message_text("❌ 未找到被屏蔽的用户。")
+        return
 
-        info_card = format_user_info_card(user)
+    info_card = format_user_info_card(user)
 
-        keyboard = [
-            [InlineKeyboardButton("解封", callback_data=f"unblock_{user_id}")],
-            [InlineKeyboardButton("返回", callback_data="return_to_list")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+    keyboard = [
+        [InlineKeyboardButton("解封", callback_data=f"unblock_{user_id}")],
+        [InlineKeyboardButton("返回", callback_data="return_to_list")]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
 
-        await query.edit_message_text(info_card, parse_mode=ParseMode.HTML, reply_markup=reply_markup)
-    finally:
-        db_session.close()
+    await query.edit_message_text(info_card, parse_mode=ParseMode.HTML, reply_markup=reply_markup)
 
 
 async def secondary_menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
+    if query.from_user.id != ADMIN_ID:
+        await query.answer("❌ 您没有权限操作。")
+        return
     await query.answer()
 
     data = query.data
@@ -601,55 +941,40 @@ async def secondary_menu_callback(update: Update, context: ContextTypes.DEFAULT_
             return
 
         user_id = int(user_id_str)
-        db_session = SessionLocal()
-        try:
-            user = db_session.get(User, user_id)
-            if user:
-                user.is_blocked = False
-                db_session.commit()
-                if user:
-                    user.is_blocked = False
-                    db_session.commit()
-
-                    blocked_users = db_session.query(User).filter_by(is_blocked=True).order_by(User.id).all()
-
-                    if blocked_users:
-                        page = 1
-                        per_page = perPage
-                        text, reply_markup = get_blocked_list_page_content(blocked_users, page, per_page)
-
-                        await query.edit_message_text(
-                            text,
-                            parse_mode=ParseMode.HTML,
-                            reply_markup=reply_markup
-                        )
-                    else:
-                        await query.edit_message_text("🚫 当前没有被屏蔽的用户。")
-                try:
-                    await context.bot.send_message(user_id, "🎉 您已被管理员解除屏蔽，现在可以正常发送消息了。")
-                except Exception as e:
-                    logger.warning(f"Failed to send unblock notification to user {user_id}: {e}")
-            else:
-                await query.edit_message_text("❌ 未找到用户。")
-        finally:
-            db_session.close()
+        if await run_db(set_user_blocked, user_id, False):
+            text, reply_markup = await build_blocked_list_page(1)
+            await query.edit_message_text(
+                text,
+                parse_mode=ParseMode.HTML,
+                reply_markup=reply_markup
+            )
+            try:
+                await context.bot.send_message(user_id, "🎉 您已被管理员解除屏蔽，现在可以正常发送消息了。")
+            except Exception as e:
+                logger.warning(f"Failed to send unblock notification to user {user_id}: {e}")
+        else:
+            await query.edit_message_text("❌ 未找到用户。")
 
     elif data == "return_to_list":
         await query.edit_message_text("↩️ 已返回到列表。请重新使用 /listblock_all 查看更新列表。")
 
 
-def get_blocked_list_page_content(users, page, per_page):
-    total_users = len(users)
-    if total_users == 0:
-        return "🚫 当前没有被屏蔽的用户。", None
-
-    total_pages = (total_users + per_page - 1) // per_page
-    page = max(1, min(page, total_pages))
+def parse_page_callback(data: str):
+    """解析 <前缀>_page_<页码>[_a<id>|_b<id>]，返回 (page, after_id, before_id)，无效时返回 None。"""
+    parts = data.split("_")[2:]
+    if not parts or not parts[0].isdigit():
+        return None
+    after_id = before_id = None
+    if len(parts) > 1 and parts[1][1:].isdigit():
+        if parts[1][0] == 'a':
+            after_id = int(parts[1][1:])
+        elif parts[1][0] == 'b':
+            before_id = int(parts[1][1:])
+    return int(parts[0]), after_id, before_id
 
-    start = (page - 1) * per_page
-    end = start + per_page
-    page_users = users[start:end]
 
+def get_blocked_list_page_content(page_users, page, per_page, total_users):
+    total_pages = (total_users + per_page - 1) // per_page
     text = f"🚫 <b>被屏蔽的用户列表 (第 {page}/{total_pages} 页，总 {total_users} 个)：</b>\n"
     keyboard = []
 
@@ -663,9 +988,11 @@ def get_blocked_list_page_content(users, page, per_page):
 
     nav_buttons = []
     if page > 1:
-        nav_buttons.append(InlineKeyboardButton("« 上一页", callback_data=f"blocked_page_{page - 1}"))
+        nav_buttons.append(InlineKeyboardButton(
+            "« 上一页", callback_data=f"blocked_page_{page - 1}_b{page_users[0].id}"))
     if page < total_pages:
-        nav_buttons.append(InlineKeyboardButton("下一页 »", callback_data=f"blocked_page_{page + 1}"))
+        nav_buttons.append(InlineKeyboardButton(
+            "下一页 »", callback_data=f"blocked_page_{page + 1}_a{page_users[-1].id}"))
     if nav_buttons:
         keyboard.append(nav_buttons)
 
@@ -673,24 +1000,40 @@ def get_blocked_list_page_content(users, page, per_page):
     return text, reply_markup
 
 
+async def build_blocked_list_page(page, after_id=None, before_id=None):
+    per_page = perPage
+    total_users = await run_db(BLOCKED_COUNT.get)
+    if not total_users:
+        return "🚫 当前没有被屏蔽的用户。", None
+    total_pages = (total_users + per_page - 1) // per_page
+    page = max(1, min(page, total_pages))
+    users = await run_db(load_blocked_page, page, per_page, after_id, before_id)
+    if not users:
+        users = await run_db(load_blocked_page, page, per_page)
+    if not users:
+        # 缓存的总数可能落后于网页面板的解封操作，重新计数后取最后一页。
+        BLOCKED_COUNT.invalidate()
+        total_users = await run_db(BLOCKED_COUNT.get)
+        page = max(1, (total_users + per_page - 1) // per_page)
+        users = await run_db(load_blocked_page, page, per_page) if total_users else []
+    if not users:
+        return "🚫 当前没有被屏蔽的用户。", None
+    return get_blocked_list_page_content(users, page, per_page, total_users)
+
+
 async def blocked_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
+    if query.from_user.id != ADMIN_ID:
+        await query.answer("❌ 您没有权限操作。")
+        return
     await query.answer()
 
-    page_str = query.data.split("_")[-1]
-    if not page_str.isdigit():
+    anchor = parse_page_callback(query.data)
+    if anchor is None:
         return
 
-    page = int(page_str)
-    db_session = SessionLocal()
-    try:
-        users = db_session.query(User).filter_by(is_blocked=True).order_by(User.id).all()
-        per_page = perPage
-
-        text, reply_markup = get_blocked_list_page_content(users, page, per_page)
-        await query.edit_message_text(text, parse_mode=ParseMode.HTML, reply_markup=reply_markup)
-    finally:
-        db_session.close()
+    text, reply_markup = await build_blocked_list_page(*anchor)
+    await query.edit_message_text(text, parse_mode=ParseMode.HTML, reply_markup=reply_markup)
 
 
 async def user_info_callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -705,9 +1048,8 @@ async def user_info_callback_handler(update: Update, context: ContextTypes.DEFAU
 
     user_id = int(user_id_str)
 
-    db_session = SessionLocal()
     try:
-        user = db_session.get(User, user_id)
+        user = await run_db(load_user, user_id)
         if not user:
             await query.message.reply_text("❌ 未在数据库中找到该用户。")
             return
@@ -718,8 +1060,6 @@ async def user_info_callback_handler(update: Update, context: ContextTypes.DEFAU
     except Exception as e:
         logger.error(f"Error processing user_info callback: {e}")
         await query.message.reply_text(f"❌ 发生错误: {e}")
-    finally:
-        db_session.close()
 
 
 def format_user_info_card(user: User):
@@ -752,11 +1092,8 @@ async def handle_admin_reply(update: Update, context: ContextTypes.DEFAULT_TYPE)
     if replied_msg.from_user.is_bot and replied_msg.reply_to_message:
         fwd_msg = replied_msg.reply_to_message
 
-    db_session = SessionLocal()
     try:
-        from database import MessageMap
-        mapping = db_session.get(MessageMap, fwd_msg.message_id)
-        target_user_id = mapping.user_id if mapping else None
+        target_user_id = await resolve_reply_target(fwd_msg.message_id)
 
         if not target_user_id:
             await message.reply_text("❌ 无法识别要操作的用户。请确保您回复的是用户转发给您的消息。")
@@ -767,17 +1104,46 @@ async def handle_admin_reply(update: Update, context: ContextTypes.DEFAULT_TYPE)
     except Exception as e:
         await message.reply_text(f"回复发送失败: {e}")
 
+
+async def resolve_reply_target(admin_msg_id: int):
+    user_id = REPLY_TARGETS.get(admin_msg_id) or MESSAGE_WRITER.lookup_user_id(admin_msg_id)
+    if user_id is not None:
+        return user_id
+    user_id = await run_db(load_mapped_user_id, admin_msg_id)
+    if user_id is not None:
+        REPLY_TARGETS.put(admin_msg_id, user_id)
+    return user_id
+
+
+def load_config_row():
+    db_session = SessionLocal()
+    try:
+        return db_session.query(Config).first()
     finally:
         db_session.close()
 
 
-async def send_blocked_list_page(original_message, users, page, per_page):
-    text, reply_markup = get_blocked_list_page_content(users, page, per_page)
-    await original_message.reply_text(text, parse_mode=ParseMode.HTML, reply_markup=reply_markup)
+def apply_verify_setting(data: str):
+    db_session = SessionLocal()
+    try:
+        config = db_session.query(Config).first()
+        if not config:
+            return None
+        if data == "vs_toggle":
+            config.verification_enabled = not config.verification_enabled
+        elif data.startswith("vs_set_type_"):
+            config.verification_type = data.split("_")[-1]
+        elif data.startswith("vs_set_diff_"):
+            config.verification_difficulty = data.split("_")[-1]
+        bump_version(db_session, CONFIG_VERSION)
+        db_session.commit()
+        db_session.refresh(config)
+        return config
+    finally:
+        db_session.close()
 
 
-async def get_verify_menu_content(db_session):
-    config = db_session.query(Config).first()
+def get_verify_menu_content(config):
     if not config:
         return "❌ 未找到配置。", None
     status_text = "🟢 开启" if config.verification_enabled else "🔴 关闭"
@@ -815,15 +1181,12 @@ async def get_verify_menu_content(db_session):
 
 
 async def verify_settings_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    db_session = SessionLocal()
-    try:
-        text, reply_markup = await get_verify_menu_content(db_session)
-        if reply_markup:
-            await update.message.reply_text(text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
-        else:
-            await update.message.reply_text(text)
-    finally:
-        db_session.close()
+    config = await run_db(load_config_row)
+    text, reply_markup = get_verify_menu_content(config)
+    if reply_markup:
+        await update.message.reply_text(text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+    else:
+        await update.message.reply_text(text)
 
 
 async def verify_settings_callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -833,23 +1196,16 @@ async def verify_settings_callback_handler(update: Update, context: ContextTypes
         await query.answer("❌ 您没有权限操作。")
         return
     data = query.data
-    db_session = SessionLocal()
     try:
-        config = db_session.query(Config).first()
+        if data == "vs_close":
+            await query.delete_message()
+            return
+        config = await run_db(apply_verify_setting, data)
         if not config:
             await query.edit_message_text("❌ 未找到配置。")
             return
-        if data == "vs_toggle":
-            config.verification_enabled = not config.verification_enabled
-        elif data.startswith("vs_set_type_"):
-            config.verification_type = data.split("_")[-1]
-        elif data.startswith("vs_set_diff_"):
-            config.verification_difficulty = data.split("_")[-1]
-        elif data == "vs_close":
-            await query.delete_message()
-            return
-        db_session.commit()
-        text, reply_markup = await get_verify_menu_content(db_session)
+        await run_db(BOT_CONFIG_CACHE.reload)
+        text, reply_markup = get_verify_menu_content(config)
         await query.edit_message_text(
             text,
             reply_markup=reply_markup,
@@ -858,31 +1214,150 @@ async def verify_settings_callback_handler(update: Update, context: ContextTypes
     except Exception as e:
         logger.error(f"Error in verify_settings_callback_handler: {e}")
         await query.answer("❌ 操作失败。")
+
+
+def save_start_message(lang: str, content: str):
+    db_session = SessionLocal()
+    try:
+        msg = db_session.query(StartMessage).filter_by(lang=lang).first()
+        if not msg:
+            db_session.add(StartMessage(lang=lang, content=content))
+        else:
+            msg.content = content
+        db_session.commit()
+    finally:
+        db_session.close()
+
+
+def add_blocked_keyword(kw: str):
+    db_session = SessionLocal()
+    try:
+        if db_session.query(BlockedKeyword).filter_by(keyword=kw).first():
+            return False
+        db_session.add(BlockedKeyword(keyword=kw, added_at=now_sh()))
+        bump_version(db_session, KEYWORDS_VERSION)
+        db_session.commit()
+        return True
+    finally:
+        db_session.close()
+
+
+def remove_blocked_keyword(kw: str):
+    db_session = SessionLocal()
+    try:
+        kw_obj = db_session.query(BlockedKeyword).filter_by(keyword=kw).first()
+        if not kw_obj:
+            return False
+        db_session.delete(kw_obj)
+        bump_version(db_session, KEYWORDS_VERSION)
+        db_session.commit()
+        return True
     finally:
         db_session.close()
 
 
+def load_keyword_page(page, per_page, after_id=None, before_id=None):
+    db_session = SessionLocal()
+    try:
+        query = db_session.query(BlockedKeyword.id, BlockedKeyword.keyword)
+        if after_id is not None:
+            return query.filter(BlockedKeyword.id > after_id).order_by(BlockedKeyword.id).limit(per_page).all()
+        if before_id is not None:
+            return query.filter(BlockedKeyword.id < before_id).order_by(desc(BlockedKeyword.id)) \
+                .limit(per_page).all()[::-1]
+        return query.order_by(BlockedKeyword.id).offset((page - 1) * per_page).limit(per_page).all()
+    finally:
+        db_session.close()
+
+
+def export_keywords():
+    """把全部关键词逐批写入临时文件（每行一个），返回已回到开头的文件对象。"""
+    out = tempfile.TemporaryFile()
+    try:
+        for chunk in iter_export():
+            out.write(chunk.encode('utf-8'))
+    except Exception:
+        out.close()
+        raise
+    out.seek(0)
+    return out
+
+
+def get_keyword_page_content(rows, page, per_page, total):
+    total_pages = (total + per_page - 1) // per_page
+    lines = [f"📃 <b>当前屏蔽关键词列表 (第 {page}/{total_pages} 页，共 {total} 个)：</b>\n"]
+    for _, kw in rows:
+        if len(kw) > KEYWORD_DISPLAY_LENGTH:
+            kw = kw[:KEYWORD_DISPLAY_LENGTH] + '…'
+        lines.append(f"• <code>{escape_html(kw)}</code>")
+
+    nav_buttons = []
+    if page > 1:
+        nav_buttons.append(InlineKeyboardButton("« 上一页", callback_data=f"kw_page_{page - 1}_b{rows[0][0]}"))
+    if page < total_pages:
+        nav_buttons.append(InlineKeyboardButton("下一页 »", callback_data=f"kw_page_{page + 1}_a{rows[-1][0]}"))
+    keyboard = [nav_buttons] if nav_buttons else []
+    keyboard.append([InlineKeyboardButton("📄 导出全部", callback_data="kw_export")])
+    return "\n".join(lines), InlineKeyboardMarkup(keyboard)
+
+
+async def build_keyword_page(page, after_id=None, before_id=None):
+    per_page = KEYWORDS_PER_PAGE
+    total = KEYWORD_INDEX.count
+    if not total:
+        return "📃 当前屏蔽关键词列表为空。", None
+    total_pages = (total + per_page - 1) // per_page
+    page = max(1, min(page, total_pages))
+    rows = await run_db(load_keyword_page, page, per_page, after_id, before_id)
+    if not rows:
+        rows = await run_db(load_keyword_page, page, per_page)
+    if not rows:
+        page = total_pages
+        rows = await run_db(load_keyword_page, page, per_page)
+    if not rows:
+        return "📃 当前屏蔽关键词列表为空。", None
+    return get_keyword_page_content(rows, page, per_page, total)
+
+
+async def keyword_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    if query.from_user.id != ADMIN_ID:
+        await query.answer("❌ 您没有权限操作。")
+        return
+    await query.answer()
+
+    if query.data == "kw_export":
+        document = await run_db(export_keywords)
+        try:
+            await query.message.reply_document(
+                document=document,
+                filename=f"keywords-{now_sh().strftime('%Y%m%d-%H%M%S')}.txt",
+                caption=f"📄 共 {KEYWORD_INDEX.count} 个屏蔽关键词"
+            )
+        finally:
+            document.close()
+        return
+
+    anchor = parse_page_callback(query.data)
+    if anchor is None:
+        return
+    text, reply_markup = await build_keyword_page(*anchor)
+    await query.edit_message_text(text, parse_mode=ParseMode.HTML, reply_markup=reply_markup)
+
+
 async def admin_command_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    from database import MessageMap
     message = update.message
     command_text = message.text.split(' ', 1)
     command = command_text[0].lower()
     args = command_text[1] if len(command_text) > 1 else ""
 
-    db_session = SessionLocal()
     try:
         if command == '/setstart_zh':
             if not args:
                 await message.reply_text("用法: /setstart_zh <要设置的中文欢迎语>")
                 return
 
-            msg = db_session.query(StartMessage).filter_by(lang="zh").first()
-            if not msg:
-                msg = StartMessage(lang="zh", content=args)
-                db_session.add(msg)
-            else:
-                msg.content = args
-            db_session.commit()
+            await run_db(save_start_message, "zh", args)
             await message.reply_text("✅ 已更新中文 (zh) 欢迎消息。")
             return
 
@@ -891,13 +1366,7 @@ async def admin_command_handler(update: Update, context: ContextTypes.DEFAULT_TY
                 await message.reply_text("用法: /setstart_en <English welcome message>")
                 return
 
-            msg = db_session.query(StartMessage).filter_by(lang="en").first()
-            if not msg:
-                msg = StartMessage(lang="en", content=args)
-                db_session.add(msg)
-            else:
-                msg.content = args
-            db_session.commit()
+            await run_db(save_start_message, "en", args)
             await message.reply_text("✅ English (en) welcome message updated.")
             return
 
@@ -907,13 +1376,10 @@ async def admin_command_handler(update: Update, context: ContextTypes.DEFAULT_TY
                 return
 
             kw = args.strip().lower()
-            exists = db_session.query(BlockedKeyword).filter_by(keyword=kw).first()
-            if exists:
+            if not await run_db(add_blocked_keyword, kw):
                 await message.reply_text(f"关键词 <code>{escape_html(kw)}</code> 已存在。", parse_mode=ParseMode.HTML)
             else:
-                new_kw = BlockedKeyword(keyword=kw, added_at=now_sh())
-                db_session.add(new_kw)
-                db_session.commit()
+                await run_db(KEYWORD_INDEX.reload)
                 await message.reply_text(f"✅ 已添加屏蔽关键词：<code>{escape_html(kw)}</code>",
                                          parse_mode=ParseMode.HTML)
             return
@@ -924,10 +1390,8 @@ async def admin_command_handler(update: Update, context: ContextTypes.DEFAULT_TY
                 return
 
             kw = args.strip().lower()
-            kw_obj = db_session.query(BlockedKeyword).filter_by(keyword=kw).first()
-            if kw_obj:
-                db_session.delete(kw_obj)
-                db_session.commit()
+            if await run_db(remove_blocked_keyword, kw):
+                await run_db(KEYWORD_INDEX.reload)
                 await message.reply_text(f"✅ 已移除屏蔽关键词：<code>{escape_html(kw)}</code>",
                                          parse_mode=ParseMode.HTML)
             else:
@@ -935,29 +1399,13 @@ async def admin_command_handler(update: Update, context: ContextTypes.DEFAULT_TY
             return
 
         if command == '/listkw_all':
-            keywords = db_session.query(BlockedKeyword.keyword).all()
-            if not keywords:
-                await message.reply_text("📃 当前屏蔽关键词列表为空。")
-                return
-
-            total = len(keywords)
-            words = "  ".join([f"<code>{escape_html(kw)}</code>" for (kw,) in keywords])
-            text = (
-                f"📃 <b>当前屏蔽关键词列表（共 {total} 个）：</b>\n\n"
-                f"{words}"
-            )
-            await message.reply_text(text, parse_mode=ParseMode.HTML)
+            text, reply_markup = await build_keyword_page(1)
+            await message.reply_text(text, parse_mode=ParseMode.HTML, reply_markup=reply_markup)
             return
 
         if command == '/listblock_all':
-            users = db_session.query(User).filter_by(is_blocked=True).order_by(User.id).all()
-            if not users:
-                await message.reply_text("🚫 当前没有被屏蔽的用户。")
-                return
-
-            page = 1
-            per_page = perPage
-            await send_blocked_list_page(message, users, page, per_page)
+            text, reply_markup = await build_blocked_list_page(1)
+            await message.reply_text(text, parse_mode=ParseMode.HTML, reply_markup=reply_markup)
             return
 
         if command in ['/block', '/unblock', '/checkblock', '/info']:
@@ -972,14 +1420,13 @@ async def admin_command_handler(update: Update, context: ContextTypes.DEFAULT_TY
             if replied_msg.from_user.is_bot and replied_msg.reply_to_message:
                 fwd_msg = replied_msg.reply_to_message
 
-            mapping = db_session.get(MessageMap, fwd_msg.message_id)
-            target_user_id = mapping.user_id if mapping else None
+            target_user_id = await resolve_reply_target(fwd_msg.message_id)
 
             if not target_user_id:
                 await message.reply_text("❌ 无法识别要操作的用户。请确保你回复的是转发消息。")
                 return
 
-            target_user = db_session.get(User, target_user_id)
+            target_user = await run_db(load_user, target_user_id)
             if not target_user:
                 try:
                     user_data_source = await context.bot.get_chat(target_user_id)
@@ -989,7 +1436,7 @@ async def admin_command_handler(update: Update, context: ContextTypes.DEFAULT_TY
                         'first_name': user_data_source.first_name,
                         'last_name': user_data_source.last_name,
                     }
-                    target_user = get_or_create_user(db_session, user_data)
+                    target_user = await run_db(ensure_user, user_data)
                 except Exception as e:
                     logger.error(f"Could not find user {target_user_id} in DB and could not fetch from TG: {e}")
                     await message.reply_text(f"数据库中未找到用户 <code>{target_user_id}</code>。",
@@ -997,8 +1444,7 @@ async def admin_command_handler(update: Update, context: ContextTypes.DEFAULT_TY
                     return
 
             if command == '/block':
-                target_user.is_blocked = True
-                db_session.commit()
+                await run_db(set_user_blocked, target_user_id, True)
                 await message.reply_text(f"✅ 用户 <code>{target_user_id}</code> 已被屏蔽。", parse_mode=ParseMode.HTML)
                 try:
                     await context.bot.send_message(target_user_id, "🚫 您已被管理员屏蔽，无法发送消息。")
@@ -1006,8 +1452,7 @@ async def admin_command_handler(update: Update, context: ContextTypes.DEFAULT_TY
                     logger.warning(f"Failed to send block notification to user {target_user_id}: {e}")
 
             elif command == '/unblock':
-                target_user.is_blocked = False
-                db_session.commit()
+                await run_db(set_user_blocked, target_user_id, False)
                 await message.reply_text(f"✅ 用户 <code>{target_user_id}</code> 已解除屏蔽。", parse_mode=ParseMode.HTML)
                 try:
                     await context.bot.send_message(target_user_id, "🎉 您已被管理员解除屏蔽，现在可以正常发送消息了。")
@@ -1020,8 +1465,6 @@ async def admin_command_handler(update: Update, context: ContextTypes.DEFAULT_TY
     except Exception as e:
         await message.reply_text(f"❌ 命令执行失败：\n{escape_html(str(e))}", parse_mode=ParseMode.HTML)
         logger.error(f"Error executing admin command {command}: {e}", exc_info=True)
-    finally:
-        db_session.close()
 
 
 async def set_admin_commands(app: Application):
@@ -1046,8 +1489,44 @@ async def set_admin_commands(app: Application):
     await app.bot.set_my_commands(user_commands)
 
 
+async def post_init(application: Application):
+    MESSAGE_WRITER.start()
+    CAPTCHA_POOL.start()
+    await run_db(KEYWORD_INDEX.reload)
+    if PERSIST_VERIFICATIONS:
+        VERIFICATION_STORE.restore(await run_db(load_verifications))
+        logger.info(f"Restored {len(VERIFICATION_STORE)} pending verifications.")
+    today = sh_day()
+    DAILY_STATS.seed_dialog_users(today, await run_db(load_dialog_users, today))
+    application.job_queue.run_repeating(
+        poll_state_versions, interval=STATE_POLL_INTERVAL, first=STATE_POLL_INTERVAL, name='poll_state_versions'
+    )
+    application.job_queue.run_repeating(
+        flush_user_activity, interval=USER_FLUSH_INTERVAL, first=USER_FLUSH_INTERVAL, name='flush_user_activity'
+    )
+    application.job_queue.run_repeating(
+        refill_captcha_pool, interval=CAPTCHA_REFILL_INTERVAL, first=0, name='refill_captcha_pool'
+    )
+    application.job_queue.run_repeating(
+        sweep_verifications, interval=VERIFICATION_SWEEP_INTERVAL, first=VERIFICATION_SWEEP_INTERVAL,
+        name='sweep_verifications'
+    )
+    application.job_queue.run_repeating(
+        flush_daily_stats, interval=STATS_FLUSH_INTERVAL, first=STATS_FLUSH_INTERVAL, name='flush_daily_stats'
+    )
+    application.job_queue.run_repeating(
+        apply_retention, interval=RETENTION_INTERVAL, first=60, name='apply_retention'
+    )
+    await set_admin_commands(application)
+
+
 async def post_shutdown(application: Application):
-    bot_config = load_db_config()
+    await MESSAGE_WRITER.stop()
+    CAPTCHA_POOL.stop()
+    await sweep_verifications()
+    await flush_user_activity()
+    await flush_daily_stats()
+    bot_config = get_bot_config()
     if bot_config and bot_config.get('UPDATE_METHOD') == 'webhook':
         logger.info("Gracefully shutting down: Deleting webhook...")
         try:
@@ -1064,15 +1543,18 @@ def main():
 
     BOT_CONFIG = None
     while BOT_CONFIG is None:
-        BOT_CONFIG = load_db_config()
+        BOT_CONFIG_CACHE.reload()
+        BOT_CONFIG = BOT_CONFIG_CACHE.config
         if BOT_CONFIG is None:
             logger.warning("数据库未找到配置，等待 Web 面板完成初始化...")
             time.sleep(5)
 
     ADMIN_ID = int(BOT_CONFIG['ADMIN_ID'])
+    max_concurrent_updates = BOT_CONFIG.get('MAX_CONCURRENT_UPDATES') or DEFAULT_MAX_CONCURRENT_UPDATES
+    logger.info(f"Processing up to {max_concurrent_updates} updates concurrently (ordered per user).")
 
-    app = Application.builder().token(BOT_CONFIG['BOT_TOKEN']).post_init(set_admin_commands).post_shutdown(
-        post_shutdown).build()
+    app = Application.builder().token(BOT_CONFIG['BOT_TOKEN']).concurrent_updates(
+        PerUserUpdateProcessor(max_concurrent_updates)).post_init(post_init).post_shutdown(post_shutdown).build()
 
     admin_filter = filters.User(user_id=ADMIN_ID)
     app.add_handler(CommandHandler(
@@ -1092,6 +1574,7 @@ def main():
     app.add_handler(CallbackQueryHandler(view_blocked_user_callback, pattern="^view_blocked_"))
     app.add_handler(CallbackQueryHandler(secondary_menu_callback, pattern="^(unblock_|return_to_list)"))
     app.add_handler(CallbackQueryHandler(blocked_page_callback, pattern="^blocked_page_"))
+    app.add_handler(CallbackQueryHandler(keyword_page_callback, pattern="^kw_(page_|export$)"))
 
     update_method = BOT_CONFIG.get('UPDATE_METHOD', 'polling')
     try:
@@ -0,0 +1,180 @@
+import logging
+import os
+import subprocess
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+
+import psutil
+
+logger = logging.getLogger(__name__)
+
+
+class BotSupervisor:
+    """托管 bot.py 子进程：PID 文件、日志排空到滚动文件、崩溃后指数退避重启、状态查询。"""
+
+    def __init__(self, command, pid_file='bot.pid', log_file='logs/bot.log', log_max_bytes=5 * 1024 * 1024,
+                 log_backups=5, min_backoff=1, max_backoff=60, stable_after=60, stop_timeout=10):
+        self.command = command
+        self.pid_file = pid_file
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.stable_after = stable_after
+        self.stop_timeout = stop_timeout
+        self.restarts = 0
+        self.last_exit_code = None
+        self._log_file = log_file
+        self._log_max_bytes = log_max_bytes
+        self._log_backups = log_backups
+        self._output = None
+        self._process = None
+        self._ps = None
+        self._started_at = None
+        self._failures = 0
+        self._wanted = False
+        self._lock = threading.RLock()
+        self._wake = threading.Event()
+        self._monitor = None
+
+    def _output_logger(self):
+        if self._output is None:
+            os.makedirs(os.path.dirname(self._log_file) or '.', exist_ok=True)
+            handler = RotatingFileHandler(self._log_file, maxBytes=self._log_max_bytes,
+                                          backupCount=self._log_backups, encoding='utf-8')
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            self._output = logging.getLogger('bot.output')
+            self._output.setLevel(logging.INFO)
+            self._output.propagate = False
+            self._output.addHandler(handler)
+        return self._output
+
+    def _drain(self, process):
+        output = self._output_logger()
+        for line in iter(process.stdout.readline, b''):
+            output.info(line.decode('utf-8', errors='replace').rstrip('\n'))
+        process.stdout.close()
+
+    def _kill_orphan(self):
+        """面板异常退出后，PID 文件里记录的旧 bot 进程可能仍在运行，先结束它再启动新进程。"""
+        try:
+            with open(self.pid_file) as f:
+                pid = int(f.read().strip())
+            orphan = psutil.Process(pid)
+            if not any('bot.py' in part for part in orphan.cmdline()):
+                return
+        except (OSError, ValueError, psutil.Error):
+            return
+        logger.warning(f"Stopping orphaned bot process {pid} from {self.pid_file}")
+        orphan.terminate()
+        try:
+            orphan.wait(self.stop_timeout)
+        except psutil.TimeoutExpired:
+            orphan.kill()
+
+    def _spawn(self):
+        self._kill_orphan()
+        self._process = subprocess.Popen(self.command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        self._ps = psutil.Process(self._process.pid)
+        self._ps.cpu_percent(None)
+        self._started_at = time.monotonic()
+        with open(self.pid_file, 'w') as f:
+            f.write(str(self._process.pid))
+        threading.Thread(target=self._drain, args=(self._process,), name='bot-output', daemon=True).start()
+        logger.info(f"Started bot process {self._process.pid}")
+
+    def is_running(self):
+        with self._lock:
+            return self._process is not None and self._process.poll() is None
+
+    def start(self):
+        with self._lock:
+            self._wanted = True
+            if self.is_running():
+                return False
+            self._failures = 0
+            self._spawn()
+            if self._monitor is None:
+                self._monitor = threading.Thread(target=self._watch, name='bot-supervisor', daemon=True)
+                self._monitor.start()
+            return True
+
+    def stop(self):
+        with self._lock:
+            self._wanted = False
+            self._wake.set()
+            process = self._process
+            if process is None:
+                return
+            if process.poll() is None:
+                logger.info(f"Stopping bot process {process.pid}")
+                process.terminate()
+                try:
+                    process.wait(self.stop_timeout)
+                except subprocess.TimeoutExpired:
+                    logger.warning(f"Bot process {process.pid} did not exit in {self.stop_timeout}s, killing it")
+                    process.kill()
+                    process.wait()
+            self.last_exit_code = process.returncode
+            self._process = None
+            self._ps = None
+            try:
+                os.remove(self.pid_file)
+            except FileNotFoundError:
+                pass
+
+    def restart(self):
+        with self._lock:
+            self.stop()
+            self.start()
+
+    def _watch(self):
+        while True:
+            with self._lock:
+                if not self._wanted:
+                    self._monitor = None
+                    return
+                process = self._process
+                exited = process is not None and process.poll() is not None
+                if exited:
+                    self.last_exit_code = process.returncode
+                    if time.monotonic() - self._started_at >= self.stable_after:
+                        self._failures = 0
+                    delay = min(self.max_backoff, self.min_backoff * 2 ** self._failures)
+                    self._failures += 1
+                    self._process = None
+                    self._ps = None
+                    logger.warning(f"Bot process {process.pid} exited with code {process.returncode}, "
+                                   f"restarting in {delay}s")
+            if not exited:
+                self._wake.wait(1)
+                self._wake.clear()
+                continue
+            self._wake.wait(delay)
+            self._wake.clear()
+            with self._lock:
+                if not self._wanted or self._process is not None:
+                    continue
+                self.restarts += 1
+                self._spawn()
+
+    def status(self):
+        with self._lock:
+            running = self.is_running()
+            status = {
+                'running': running,
+                'supervised': self._wanted,
+                'pid': self._process.pid if running else None,
+                'uptime': round(time.monotonic() - self._started_at) if running else None,
+                'restarts': self.restarts,
+                'last_exit_code': self.last_exit_code,
+                'memory_rss': None,
+                'cpu_percent': None,
+            }
+            if running:
+                try:
+                    with self._ps.oneshot():
+                        status['memory_rss'] = self._ps.memory_info().rss
+                        status['cpu_percent'] = self._ps.cpu_percent(None)
+                except psutil.Error:
+                    pass
+            return status
@@ -0,0 +1,102 @@
+import asyncio
+import logging
+import multiprocessing
+import random
+import string
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from captcha.image import ImageCaptcha
+
+logger = logging.getLogger(__name__)
+
+CAPTCHA_LENGTHS = {'easy': 4, 'medium': 6, 'hard': 8, 'hell': 10}
+CAPTCHA_CHARS = string.ascii_letters + string.digits
+
+_rng = random.SystemRandom()
+_image = None
+
+
+def captcha_length(difficulty: str):
+    return CAPTCHA_LENGTHS.get(difficulty, CAPTCHA_LENGTHS['easy'])
+
+
+def render_captcha(length: int):
+    global _image
+    if _image is None:
+        _image = ImageCaptcha()
+    text = ''.join(_rng.choices(CAPTCHA_CHARS, k=length))
+    return text, _image.generate(text).getvalue()
+
+
+class CaptchaPool:
+    """图片验证码在子进程中渲染，并按难度预先生成一批 (text, PNG) 备用，签发时直接取出。"""
+
+    def __init__(self, size=20, workers=2):
+        self.size = size
+        self.workers = workers
+        self.hits = 0
+        self.misses = 0
+        self._pools = {difficulty: deque() for difficulty in CAPTCHA_LENGTHS}
+        self._executor = None
+        self._refilling = False
+
+    def start(self):
+        # 机器人进程里已有数据库线程池和事件循环线程，fork 可能继承被占用的锁而死锁，改用 spawn。
+        self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+
+    async def render(self, difficulty: str):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, render_captcha, captcha_length(difficulty))
+
+    async def take(self, difficulty: str):
+        if difficulty not in self._pools:
+            difficulty = 'easy'
+        pool = self._pools[difficulty]
+        if pool:
+            self.hits += 1
+            return pool.popleft()
+        self.misses += 1
+        return await self.render(difficulty)
+
+    async def refill(self, difficulties):
+        """补满 difficulties 对应的池，并清空其余难度的池，切换难度后不再发出旧难度的验证码。"""
+        if self._refilling or self._executor is None:
+            return
+        for difficulty, pool in self._pools.items():
+            if difficulty not in difficulties:
+                pool.clear()
+        self._refilling = True
+        try:
+            for difficulty in difficulties:
+                pool = self._pools[difficulty]
+                missing = self.size - len(pool)
+                if missing <= 0:
+                    continue
+                results = await asyncio.gather(
+                    *(self.render(difficulty) for _ in range(missing)), return_exceptions=True
+                )
+                for result in results:
+                    if isinstance(result, Exception):
+                        logger.error(f"Captcha render failed: {result}")
+                    elif len(pool) < self.size:
+                        pool.append(result)
+        finally:
+            self._refilling = False
+
+    def stats(self):
+        taken = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / taken if taken else None,
+            'pooled': {difficulty: len(pool) for difficulty, pool in self._pools.items()},
+        }
+
+    def stop(self):
+        if self._executor is None:
+            return
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+        stats = self.stats()
+        logger.info(f"Captcha pool stopped: {stats['hits']} hits, {stats['misses']} misses.")
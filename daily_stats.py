@@ -0,0 +1,99 @@
+import datetime
+import threading
+from zoneinfo import ZoneInfo
+
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from database import SessionLocal, DailyStat, SentMessage
+
+SH_TZ = ZoneInfo('Asia/Shanghai')
+COUNTERS = ('new_users', 'messages', 'dialog_users', 'blocked_hits', 'verifications_passed', 'verifications_failed')
+
+
+def sh_day(moment=None):
+    moment = moment or datetime.datetime.now(SH_TZ)
+    return moment.astimezone(SH_TZ).date().isoformat()
+
+
+def sh_day_bounds(day: str):
+    start = datetime.datetime.combine(datetime.date.fromisoformat(day), datetime.time(), tzinfo=SH_TZ)
+    utc = ZoneInfo('UTC')
+    return start.astimezone(utc), (start + datetime.timedelta(days=1)).astimezone(utc)
+
+
+class DailyStatsBuffer:
+    """按上海日期累计的统计增量，定期合并写入 daily_stats。"""
+
+    def __init__(self):
+        self._pending = {}
+        self._dialog_day = None
+        self._dialog_users = set()
+        self._lock = threading.Lock()
+
+    def _counts(self, day):
+        counts = self._pending.get(day)
+        if counts is None:
+            counts = self._pending[day] = dict.fromkeys(COUNTERS, 0)
+        return counts
+
+    def incr(self, counter, amount=1):
+        day = sh_day()
+        with self._lock:
+            self._counts(day)[counter] += amount
+
+    def record_message(self, user_id):
+        day = sh_day()
+        with self._lock:
+            counts = self._counts(day)
+            counts['messages'] += 1
+            if day != self._dialog_day:
+                self._dialog_day, self._dialog_users = day, set()
+            if user_id not in self._dialog_users:
+                self._dialog_users.add(user_id)
+                counts['dialog_users'] += 1
+
+    def seed_dialog_users(self, day, user_ids):
+        with self._lock:
+            if day != self._dialog_day:
+                self._dialog_day, self._dialog_users = day, set()
+            self._dialog_users.update(user_ids)
+
+    def take_pending(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return pending
+
+    def restore(self, pending):
+        with self._lock:
+            for day, counts in pending.items():
+                current = self._counts(day)
+                for counter, amount in counts.items():
+                    current[counter] += amount
+
+
+def write_daily_stats(pending: dict):
+    if not pending:
+        return
+    db = SessionLocal()
+    try:
+        for day, counts in pending.items():
+            stmt = sqlite_insert(DailyStat).values(day=day, **counts)
+            db.execute(stmt.on_conflict_do_update(
+                index_elements=[DailyStat.day],
+                set_={counter: getattr(DailyStat, counter) + getattr(stmt.excluded, counter) for counter in COUNTERS}
+            ))
+        db.commit()
+    finally:
+        db.close()
+
+
+def load_dialog_users(day: str):
+    start_utc, end_utc = sh_day_bounds(day)
+    db = SessionLocal()
+    try:
+        rows = db.query(SentMessage.user_id).filter(
+            SentMessage.sent_at >= start_utc, SentMessage.sent_at < end_utc
+        ).distinct().all()
+        return {user_id for user_id, in rows}
+    finally:
+        db.close()
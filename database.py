@@ -1,13 +1,65 @@
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, BigInteger, DateTime, Text, ForeignKey
+import asyncio
+import functools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import create_engine, event, Column, Integer, String, Boolean, BigInteger, DateTime, Text, ForeignKey, \
+    Index, select, update
 from sqlalchemy.orm import sessionmaker, declarative_base, relationship
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.sql import func
 import datetime
+from zoneinfo import ZoneInfo
+
+logger = logging.getLogger(__name__)
 
 DATABASE_URL = "sqlite:///bot_data.db"
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+DB_EXECUTOR_WORKERS = 4
+DB_POOL_SIZE = DB_EXECUTOR_WORKERS + 2
+DB_POOL_OVERFLOW = 8
+SQLITE_PRAGMAS = {
+    # 必须在 journal_mode 之前：新建的库由此直接进入增量模式；已有的库不受影响，需 python database.py vacuum 转换。
+    'auto_vacuum': 'INCREMENTAL',
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'cache_size': -16000,
+    'mmap_size': 128 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
+engine = create_engine(
+    DATABASE_URL,
+    connect_args={"check_same_thread": False},
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_POOL_OVERFLOW,
+)
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+
+event.listen(engine, "connect", set_sqlite_pragmas)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+_db_executor = None
+
+
+def get_db_executor():
+    global _db_executor
+    if _db_executor is None:
+        _db_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix='db')
+    return _db_executor
+
+
+async def run_db(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_db_executor(), functools.partial(func, *args, **kwargs))
+
 
 class User(Base):
     __tablename__ = "users"
@@ -23,6 +75,12 @@ class User(Base):
     verified_at = Column(DateTime(timezone=True), nullable=True)
     sent_messages = relationship("SentMessage", back_populates="sender")
 
+    __table_args__ = (
+        Index('ix_users_last_seen_id', 'last_seen', 'id'),
+        Index('ix_users_is_blocked_id', 'is_blocked', 'id'),
+        Index('ix_users_created_at', 'created_at'),
+    )
+
 
 class BlockedKeyword(Base):
     __tablename__ = "blocked_keywords"
@@ -30,11 +88,20 @@ class BlockedKeyword(Base):
     keyword = Column(String, unique=True, index=True, nullable=False)
     added_at = Column(DateTime(timezone=True))
 
+    __table_args__ = (
+        Index('ix_blocked_keywords_added_at', 'added_at'),
+    )
+
 
 class MessageMap(Base):
     __tablename__ = "message_map"
     admin_msg_id = Column(BigInteger, primary_key=True)
     user_id = Column(BigInteger, nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        Index('ix_message_map_created_at', 'created_at'),
+    )
 
 
 class StartMessage(Base):
@@ -52,6 +119,12 @@ class SentMessage(Base):
     sent_at = Column(DateTime(timezone=True))
     sender = relationship("User", back_populates="sent_messages")
 
+    __table_args__ = (
+        Index('ix_sent_messages_user_id_sent_at', 'user_id', 'sent_at'),
+        Index('ix_sent_messages_sent_at', 'sent_at'),
+    )
+
+
 class Config(Base):
     __tablename__ = "config"
     id = Column(Integer, primary_key=True)
@@ -68,10 +141,248 @@ class Config(Base):
     update_method = Column(String, default='polling')
     webhook_domain = Column(String, nullable=True)
     webhook_secret = Column(String, nullable=True)
+    max_concurrent_updates = Column(Integer, default=16)
+    message_map_max_age_days = Column(Integer, default=90)
+    message_map_max_rows = Column(Integer, default=500000)
+    message_retention_days = Column(Integer, default=0)
+
+
+class DailyStat(Base):
+    __tablename__ = "daily_stats"
+    day = Column(String, primary_key=True)
+    new_users = Column(Integer, nullable=False, default=0)
+    messages = Column(Integer, nullable=False, default=0)
+    dialog_users = Column(Integer, nullable=False, default=0)
+    blocked_hits = Column(Integer, nullable=False, default=0)
+    verifications_passed = Column(Integer, nullable=False, default=0)
+    verifications_failed = Column(Integer, nullable=False, default=0)
+
+
+class StateVersion(Base):
+    __tablename__ = "state_versions"
+    name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
+class PendingVerification(Base):
+    __tablename__ = "pending_verifications"
+    chat_id = Column(BigInteger, primary_key=True, autoincrement=False)
+    data = Column(Text, nullable=False)
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+
+
+def sh_date(column):
+    offset = int(datetime.datetime.now(ZoneInfo('Asia/Shanghai')).utcoffset().total_seconds())
+    return func.date(column, f"{offset:+d} seconds")
+
+
+# state_versions 中的名称：写入方递增，机器人轮询到变化后刷新对应缓存。
+KEYWORDS_VERSION = 'keywords'
+CONFIG_VERSION = 'config'
+BLOCKED_VERSION = 'blocked'
+USERS_VERSION = 'users'
+
+
+def bump_version(session, name):
+    stmt = sqlite_insert(StateVersion).values(name=name, version=1)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[StateVersion.name],
+        set_={'version': StateVersion.version + 1}
+    )
+    session.execute(stmt)
+
+
+def get_versions(session):
+    return dict(session.query(StateVersion.name, StateVersion.version).all())
+
+
+def _add_max_concurrent_updates(conn):
+    existing = {row[1] for row in conn.exec_driver_sql("PRAGMA table_info(config)")}
+    if 'max_concurrent_updates' not in existing:
+        conn.exec_driver_sql("ALTER TABLE config ADD COLUMN max_concurrent_updates INTEGER DEFAULT 16")
+
+
+def _add_query_indexes(conn):
+    for table in (User.__table__, SentMessage.__table__):
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+
+def _add_keyset_indexes(conn):
+    conn.exec_driver_sql("DROP INDEX IF EXISTS ix_users_last_seen")
+    for table in (User.__table__, BlockedKeyword.__table__):
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+
+def _backfill_daily_stats(conn):
+    day = sh_date(SentMessage.sent_at)
+    stmt = sqlite_insert(DailyStat).from_select(
+        ['day', 'messages', 'dialog_users'],
+        select(day, func.count(), func.count(SentMessage.user_id.distinct()))
+        .where(SentMessage.sent_at.isnot(None))
+        .group_by(day)
+    )
+    conn.execute(stmt.on_conflict_do_update(
+        index_elements=[DailyStat.day],
+        set_={'messages': stmt.excluded.messages, 'dialog_users': stmt.excluded.dialog_users}
+    ))
+    day = sh_date(User.created_at)
+    stmt = sqlite_insert(DailyStat).from_select(
+        ['day', 'new_users'],
+        select(day, func.count()).where(User.created_at.isnot(None)).group_by(day)
+    )
+    conn.execute(stmt.on_conflict_do_update(
+        index_elements=[DailyStat.day],
+        set_={'new_users': stmt.excluded.new_users}
+    ))
+
+
+def fts5_trigram_available(conn):
+    try:
+        conn.exec_driver_sql("CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(x, tokenize='trigram')")
+    except Exception:
+        return False
+    conn.exec_driver_sql("DROP TABLE temp.fts5_probe")
+    return True
+
+
+def _create_message_fts(conn):
+    if not fts5_trigram_available(conn):
+        logger.warning("SQLite lacks FTS5 trigram support; message search will use LIKE scans.")
+        return
+    conn.exec_driver_sql(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS sent_messages_fts USING fts5("
+        "message_text, content='sent_messages', content_rowid='pk_id', tokenize='trigram')"
+    )
+    conn.exec_driver_sql(
+        "CREATE TRIGGER IF NOT EXISTS sent_messages_fts_ai AFTER INSERT ON sent_messages BEGIN "
+        "INSERT INTO sent_messages_fts(rowid, message_text) VALUES (new.pk_id, new.message_text); END"
+    )
+    conn.exec_driver_sql(
+        "CREATE TRIGGER IF NOT EXISTS sent_messages_fts_ad AFTER DELETE ON sent_messages BEGIN "
+        "INSERT INTO sent_messages_fts(sent_messages_fts, rowid, message_text) "
+        "VALUES ('delete', old.pk_id, old.message_text); END"
+    )
+    conn.exec_driver_sql(
+        "CREATE TRIGGER IF NOT EXISTS sent_messages_fts_au AFTER UPDATE OF message_text ON sent_messages BEGIN "
+        "INSERT INTO sent_messages_fts(sent_messages_fts, rowid, message_text) "
+        "VALUES ('delete', old.pk_id, old.message_text); "
+        "INSERT INTO sent_messages_fts(rowid, message_text) VALUES (new.pk_id, new.message_text); END"
+    )
+    conn.exec_driver_sql("INSERT INTO sent_messages_fts(sent_messages_fts) VALUES ('rebuild')")
+
+
+def _create_user_search_index(conn):
+    # 表达式索引无法被反射检查，不放进模型的 __table_args__，只在这里创建。
+    for name in ('username', 'first_name', 'last_name'):
+        conn.exec_driver_sql(f"CREATE INDEX IF NOT EXISTS ix_users_{name}_lower ON users (lower({name}))")
+    if not fts5_trigram_available(conn):
+        logger.warning("SQLite lacks FTS5 trigram support; user search will use LIKE scans.")
+        return
+    columns = "username, first_name, last_name"
+    new_values = "new.username, new.first_name, new.last_name"
+    old_values = "old.username, old.first_name, old.last_name"
+    conn.exec_driver_sql(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5("
+        f"{columns}, content='users', content_rowid='id', tokenize='trigram')"
+    )
+    conn.exec_driver_sql(
+        f"CREATE TRIGGER IF NOT EXISTS users_fts_ai AFTER INSERT ON users BEGIN "
+        f"INSERT INTO users_fts(rowid, {columns}) VALUES (new.id, {new_values}); END"
+    )
+    conn.exec_driver_sql(
+        f"CREATE TRIGGER IF NOT EXISTS users_fts_ad AFTER DELETE ON users BEGIN "
+        f"INSERT INTO users_fts(users_fts, rowid, {columns}) VALUES ('delete', old.id, {old_values}); END"
+    )
+    conn.exec_driver_sql(
+        f"CREATE TRIGGER IF NOT EXISTS users_fts_au AFTER UPDATE OF {columns} ON users BEGIN "
+        f"INSERT INTO users_fts(users_fts, rowid, {columns}) VALUES ('delete', old.id, {old_values}); "
+        f"INSERT INTO users_fts(rowid, {columns}) VALUES (new.id, {new_values}); END"
+    )
+    conn.exec_driver_sql("INSERT INTO users_fts(users_fts) VALUES ('rebuild')")
+
+
+def _add_message_map_retention(conn):
+    existing = {row[1] for row in conn.exec_driver_sql("PRAGMA table_info(config)")}
+    if 'message_map_max_age_days' not in existing:
+        conn.exec_driver_sql("ALTER TABLE config ADD COLUMN message_map_max_age_days INTEGER DEFAULT 90")
+    if 'message_map_max_rows' not in existing:
+        conn.exec_driver_sql("ALTER TABLE config ADD COLUMN message_map_max_rows INTEGER DEFAULT 500000")
+    existing = {row[1] for row in conn.exec_driver_sql("PRAGMA table_info(message_map)")}
+    if 'created_at' not in existing:
+        conn.exec_driver_sql("ALTER TABLE message_map ADD COLUMN created_at DATETIME")
+    # 旧映射没有时间，按迁移时刻计，让它们在一个保留周期后自然过期。
+    conn.execute(update(MessageMap).where(MessageMap.created_at.is_(None))
+                 .values(created_at=datetime.datetime.now(datetime.timezone.utc)))
+    for index in MessageMap.__table__.indexes:
+        index.create(conn, checkfirst=True)
+
+
+def _enable_incremental_vacuum(conn):
+    # 新库在连接时已设为增量模式（见 SQLITE_PRAGMAS）；旧库需要整库 VACUUM 重建，耗时且占用同等大小的临时空间，
+    # 不在启动时隐式执行，由管理员在维护窗口运行 python database.py vacuum。
+    if conn.exec_driver_sql("PRAGMA auto_vacuum").scalar() != 2:
+        logger.warning("Database is not in incremental auto_vacuum mode, so space freed by retention is not "
+                       "returned to the filesystem. Run `python database.py vacuum` during maintenance to convert it.")
+
+
+def _add_message_retention_days(conn):
+    existing = {row[1] for row in conn.exec_driver_sql("PRAGMA table_info(config)")}
+    if 'message_retention_days' not in existing:
+        # 默认 0（不归档）：升级后不应在管理员未开启的情况下自动搬走旧记录。
+        conn.exec_driver_sql("ALTER TABLE config ADD COLUMN message_retention_days INTEGER DEFAULT 0")
+
+
+def _add_user_created_at_index(conn):
+    # users 上已有表达式索引，checkfirst 反射时会告警，直接用 IF NOT EXISTS。
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_users_created_at ON users (created_at)")
+
+
+# 按顺序追加，不要修改或删除已发布的迁移；每个迁移都必须可重复执行。
+MIGRATIONS = [
+    _add_max_concurrent_updates,
+    _add_query_indexes,
+    _backfill_daily_stats,
+    _create_message_fts,
+    _add_keyset_indexes,
+    _create_user_search_index,
+    _add_message_map_retention,
+    _enable_incremental_vacuum,
+    _add_message_retention_days,
+    _add_user_created_at_index,
+]
+
+
+def run_migrations():
+    with engine.connect() as conn:
+        current = conn.exec_driver_sql("PRAGMA user_version").scalar()
+    for version, migration in enumerate(MIGRATIONS[current:], start=current + 1):
+        with engine.begin() as conn:
+            migration(conn)
+            conn.exec_driver_sql(f"PRAGMA user_version = {version}")
+        logger.info(f"Applied database migration {version}: {migration.__name__}")
+
+
+def enable_incremental_vacuum():
+    """把旧库转换为增量 auto_vacuum 模式，返回是否执行了 VACUUM。期间会阻塞所有读写，应先停止面板和机器人。"""
+    with engine.connect() as conn:
+        if conn.exec_driver_sql("PRAGMA auto_vacuum").scalar() == 2:
+            logger.info("Database already uses incremental auto_vacuum; nothing to do.")
+            return False
+        size = conn.exec_driver_sql("PRAGMA page_count").scalar() * conn.exec_driver_sql("PRAGMA page_size").scalar()
+        logger.info(f"Rebuilding the {size / 1024 / 1024:.1f}MB database with VACUUM to enable incremental "
+                    f"auto_vacuum; this needs about as much free disk space and may take a while.")
+        started = time.perf_counter()
+        conn.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.exec_driver_sql("VACUUM")
+        logger.info(f"VACUUM finished in {time.perf_counter() - started:.1f}s.")
+    return True
 
 
 def init_db():
     Base.metadata.create_all(bind=engine)
+    run_migrations()
     from sqlalchemy.orm import Session
     db = Session(bind=engine)
     from database import StartMessage
@@ -103,4 +414,16 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
+    parser = argparse.ArgumentParser(description="数据库维护")
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('vacuum', help="把旧库转换为增量 auto_vacuum 模式（整库重建，请先停止面板和机器人）")
+    args = parser.parse_args()
+    init_db()
+    enable_incremental_vacuum()
\ No newline at end of file
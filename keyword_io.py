@@ -0,0 +1,130 @@
+import argparse
+import codecs
+import datetime
+import sys
+import time
+from zoneinfo import ZoneInfo
+
+from database import SessionLocal, BlockedKeyword, bump_version, KEYWORDS_VERSION
+
+SH_TZ = ZoneInfo('Asia/Shanghai')
+IMPORT_BATCH_SIZE = 50000
+EXPORT_CHUNK_SIZE = 1000
+
+
+def normalize_keyword(kw: str):
+    return kw.strip().lower()
+
+
+def iter_lines(stream, encoding='utf-8'):
+    """按行解码字节流，不整体读入内存；兼容 BOM 与 CRLF。"""
+    decoder = codecs.getincrementaldecoder('utf-8-sig' if encoding == 'utf-8' else encoding)(errors='replace')
+    pending = ''
+    for chunk in iter(lambda: stream.read(1 << 16), b''):
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split('\n')
+        yield from lines
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        yield pending
+
+
+def import_keywords(lines, batch_size=IMPORT_BATCH_SIZE):
+    """流式导入关键词：规范化、去重后以 INSERT OR IGNORE 分批写入，返回统计。
+
+    lines 为任意字符串可迭代对象。duplicates 为文件内重复行，existing 为库中已有的关键词。
+    每批单独提交，读取下一批时不持有写锁，不会挡住机器人的写入；版本号在最后用一个短事务递增一次。
+    """
+    started = time.perf_counter()
+    stats = {'added': 0, 'existing': 0, 'duplicates': 0, 'skipped': 0}
+    seen = set()
+    batch = []
+    db = SessionLocal()
+    try:
+        dialect = db.get_bind().dialect
+        # 所有行共用同一个 added_at，只做一次类型转换；逐行走 ORM 参数处理会占掉大半导入时间。
+        added_at_type = BlockedKeyword.added_at.type.dialect_impl(dialect)
+        added_at = added_at_type.bind_processor(dialect)(datetime.datetime.now(SH_TZ))
+        sql = "INSERT OR IGNORE INTO blocked_keywords (keyword, added_at) VALUES (?, ?)"
+
+        def flush():
+            added = db.connection().exec_driver_sql(sql, batch).rowcount
+            db.commit()
+            stats['added'] += added
+            stats['existing'] += len(batch) - added
+            batch.clear()
+
+        try:
+            for line in lines:
+                kw = normalize_keyword(line)
+                if not kw:
+                    stats['skipped'] += 1
+                    continue
+                if kw in seen:
+                    stats['duplicates'] += 1
+                    continue
+                seen.add(kw)
+                batch.append((kw, added_at))
+                if len(batch) >= batch_size:
+                    flush()
+            if batch:
+                flush()
+        finally:
+            # 中途出错时已提交的批次仍然有效，同样需要通知机器人重新加载。
+            db.rollback()
+            if stats['added']:
+                bump_version(db, KEYWORDS_VERSION)
+                db.commit()
+    finally:
+        db.close()
+    stats['elapsed'] = round(time.perf_counter() - started, 3)
+    return stats
+
+
+def iter_export(chunk_size=EXPORT_CHUNK_SIZE):
+    """按 id 顺序逐批导出关键词，每次产出一段以换行结尾的文本。"""
+    db = SessionLocal()
+    try:
+        chunk = []
+        for (kw,) in db.query(BlockedKeyword.keyword).order_by(BlockedKeyword.id).yield_per(chunk_size):
+            chunk.append(kw)
+            if len(chunk) >= chunk_size:
+                yield '\n'.join(chunk) + '\n'
+                chunk = []
+        if chunk:
+            yield '\n'.join(chunk) + '\n'
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="屏蔽关键词批量导入 / 导出")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('import', help="从文本文件导入关键词（一行一个），例如 blocklist.txt")
+    p.add_argument('path', help="文件路径，- 表示标准输入")
+    p = sub.add_parser('export', help="导出全部关键词（一行一个）")
+    p.add_argument('path', nargs='?', default='-', help="输出文件路径，默认标准输出")
+    args = parser.parse_args()
+
+    from database import init_db
+    init_db()
+    if args.command == 'import':
+        if args.path == '-':
+            stats = import_keywords(iter_lines(sys.stdin.buffer))
+        else:
+            with open(args.path, 'rb') as f:
+                stats = import_keywords(iter_lines(f))
+        print(f"新增 {stats['added']} 个，已存在 {stats['existing']} 个，文件内重复 {stats['duplicates']} 个，"
+              f"空行 {stats['skipped']} 个，耗时 {stats['elapsed']}s", file=sys.stderr)
+    else:
+        out = sys.stdout if args.path == '-' else open(args.path, 'w', encoding='utf-8')
+        try:
+            for chunk in iter_export():
+                out.write(chunk)
+        finally:
+            if out is not sys.stdout:
+                out.close()
+
+
+if __name__ == "__main__":
+    main()
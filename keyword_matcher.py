@@ -0,0 +1,75 @@
+from collections import deque
+
+
+class KeywordMatcher:
+    """Aho-Corasick 多模式匹配器：构建一次，单次扫描文本即可找出所有命中的关键词。"""
+
+    def __init__(self, keywords=()):
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [None]
+        self._dict_link = [0]
+        self.size = 0
+        for kw in keywords:
+            self._insert(kw)
+        self._build()
+
+    def _insert(self, keyword):
+        if not keyword:
+            return
+        keyword = keyword.lower()
+        node = 0
+        for ch in keyword:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(None)
+                self._dict_link.append(0)
+            node = nxt
+        if self._output[node] is None:
+            self._output[node] = keyword
+            self.size += 1
+
+    def _build(self):
+        goto, fail, output, dict_link = self._goto, self._fail, self._output, self._dict_link
+        queue = deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in goto[node].items():
+                queue.append(child)
+                f = fail[node]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                f = goto[f].get(ch, 0)
+                fail[child] = f
+                dict_link[child] = f if output[f] is not None else dict_link[f]
+
+    def __len__(self):
+        return self.size
+
+    def find_all(self, text):
+        if not text or not self.size:
+            return []
+        goto, fail, output, dict_link = self._goto, self._fail, self._output, self._dict_link
+        hits = []
+        seen = set()
+        node = 0
+        for ch in text.lower():
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            match = node if output[node] is not None else dict_link[node]
+            while match:
+                kw = output[match]
+                if kw not in seen:
+                    seen.add(kw)
+                    hits.append(kw)
+                match = dict_link[match]
+        return hits
+
+    def search(self, text):
+        hits = self.find_all(text)
+        return hits[0] if hits else None
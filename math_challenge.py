@@ -0,0 +1,167 @@
+import math
+import random
+from fractions import Fraction
+from functools import lru_cache
+
+OPS = ('+', '-', '*', '/')
+
+EXPRESSION_DIFFICULTIES = {
+    'hard': {'leaves': (4, 4), 'leaf_range': (100, 999), 'limit': 10000},
+    'hell': {'leaves': (5, 7), 'leaf_range': (1000, 9999), 'limit': 100000},
+}
+
+
+def _merge(intervals):
+    merged = []
+    for lo, hi in sorted(intervals):
+        if merged and lo <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], hi))
+        else:
+            merged.append((lo, hi))
+    return tuple(merged)
+
+
+@lru_cache(maxsize=None)
+def reach(leaves: int, lo: int, hi: int):
+    """一棵有 leaves 个叶子（取值 lo..hi）的表达式树，能保证取到的整数值区间。"""
+    if leaves == 1:
+        return ((lo, hi),)
+    intervals = []
+    for left in range(1, leaves):
+        for a_lo, a_hi in reach(left, lo, hi):
+            for b_lo, b_hi in reach(leaves - left, lo, hi):
+                intervals.append((a_lo + b_lo, a_hi + b_hi))
+                intervals.append((a_lo - b_hi, a_hi - b_lo))
+    return _merge(intervals)
+
+
+def _contains(intervals, value):
+    return any(lo <= value <= hi for lo, hi in intervals)
+
+
+def _pick(intervals, bounds):
+    candidates = []
+    for lo, hi in intervals:
+        for b_lo, b_hi in bounds:
+            c_lo, c_hi = max(lo, b_lo), min(hi, b_hi)
+            if c_lo <= c_hi:
+                candidates.append((c_lo, c_hi))
+    if not candidates:
+        return None
+    lo, hi = random.choices(candidates, weights=[hi - lo + 1 for lo, hi in candidates])[0]
+    return random.randint(lo, hi)
+
+
+def _divisors(n: int):
+    small, large = [], []
+    d = 1
+    while d * d <= n:
+        if n % d == 0:
+            small.append(d)
+            if d != n // d:
+                large.append(n // d)
+        d += 1
+    return small + large[::-1]
+
+
+def _split(op, target, left, right):
+    if op == '+':
+        a = _pick(left, [(target - hi, target - lo) for lo, hi in right])
+        return None if a is None else (a, target - a)
+    if op == '-':
+        a = _pick(left, [(target + lo, target + hi) for lo, hi in right])
+        return None if a is None else (a, a - target)
+    if target == 0:
+        return None
+    if op == '*':
+        pairs = []
+        for d in _divisors(abs(target)):
+            for a in (d, -d):
+                b = target // a
+                if abs(a) >= 2 and abs(b) >= 2 and _contains(left, a) and _contains(right, b):
+                    pairs.append((a, b))
+        return random.choice(pairs) if pairs else None
+    bounds = []
+    for lo, hi in left:
+        b_lo, b_hi = sorted((Fraction(lo, target), Fraction(hi, target)))
+        b_lo, b_hi = math.ceil(b_lo), math.floor(b_hi)
+        bounds.extend([(b_lo, min(b_hi, -2)), (max(b_lo, 2), b_hi)])
+    b = _pick(right, bounds)
+    return None if b is None else (target * b, b)
+
+
+def _build(leaves, target, lo, hi, used):
+    if leaves == 1:
+        return target
+    fresh = [op for op in OPS if op not in used]
+    seen = [op for op in OPS if op in used]
+    random.shuffle(fresh)
+    random.shuffle(seen)
+    splits = list(range(1, leaves))
+    random.shuffle(splits)
+    for op in fresh + seen:
+        for left in splits:
+            pair = _split(op, target, reach(left, lo, hi), reach(leaves - left, lo, hi))
+            if pair is None:
+                continue
+            used.add(op)
+            a, b = pair
+            return op, _build(left, a, lo, hi, used), _build(leaves - left, b, lo, hi, used)
+    raise ValueError(f"{target} is not reachable with {leaves} leaves in {lo}..{hi}")
+
+
+def build_expression(leaves: int, lo: int, hi: int, limit: int):
+    target = _pick(reach(leaves, lo, hi), [(1 - limit, -1), (1, limit - 1)])
+    return _build(leaves, target, lo, hi, set())
+
+
+def evaluate(node):
+    if isinstance(node, int):
+        return Fraction(node)
+    op, left, right = node
+    a, b = evaluate(left), evaluate(right)
+    if op == '+':
+        return a + b
+    if op == '-':
+        return a - b
+    if op == '*':
+        return a * b
+    return a / b
+
+
+def format_expression(node, top=True):
+    if isinstance(node, int):
+        return str(node)
+    op, left, right = node
+    expr = f"{format_expression(left, False)} {op} {format_expression(right, False)}"
+    return expr if top else f"({expr})"
+
+
+def generate_challenge(difficulty: str):
+    spec = EXPRESSION_DIFFICULTIES.get(difficulty)
+    if spec:
+        tree = build_expression(random.randint(*spec['leaves']), *spec['leaf_range'], spec['limit'])
+        answer = evaluate(tree)
+        return f"{format_expression(tree)} = ?", int(answer)
+
+    if difficulty == 'medium':
+        a = random.randint(10, 99)
+        b = random.randint(10, 99)
+    else:
+        a = random.randint(1, 9)
+        b = random.randint(1, 9)
+    op = random.choice(['+', '-'])
+    return f"{a} {op} {b} = ?", a + b if op == '+' else a - b
+
+
+def answer_options(answer: int, count=4):
+    options = {answer}
+    if abs(answer) >= 1000:
+        spread = 500
+    elif abs(answer) >= 100:
+        spread = 100
+    else:
+        spread = 10
+    while len(options) < count:
+        options.add(answer + random.randint(-spread, spread))
+    return [str(option) for option in sorted(options)]
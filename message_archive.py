@@ -0,0 +1,118 @@
+import datetime
+import glob
+import gzip
+import json
+import os
+import zlib
+
+from sqlalchemy import delete
+
+from daily_stats import sh_day
+from database import SessionLocal, SentMessage
+
+ARCHIVE_DIR = 'archive'
+ARCHIVE_PREFIX = 'sent_messages-'
+ARCHIVE_SUFFIX = '.jsonl.gz'
+ARCHIVE_CURSOR_PREFIX = 'a.'
+
+
+def archive_path(month: str, archive_dir=ARCHIVE_DIR):
+    return os.path.join(archive_dir, f"{ARCHIVE_PREFIX}{month}{ARCHIVE_SUFFIX}")
+
+
+def archive_month(moment):
+    """归档文件按上海时间的月份划分，与每日统计一致；库里的 sent_at 是不带时区的 UTC。"""
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=datetime.timezone.utc)
+    return sh_day(moment)[:7]
+
+
+def archive_months(archive_dir=ARCHIVE_DIR):
+    """已有归档的月份（YYYY-MM），从新到旧。"""
+    paths = glob.glob(os.path.join(archive_dir, f"{ARCHIVE_PREFIX}*{ARCHIVE_SUFFIX}"))
+    return sorted((os.path.basename(p)[len(ARCHIVE_PREFIX):-len(ARCHIVE_SUFFIX)] for p in paths), reverse=True)
+
+
+def archive_batch(created_before, batch_size=5000, archive_dir=ARCHIVE_DIR):
+    """把 sent_at 早于 created_before 的最旧一批消息追加到按月的 gzip JSONL 文件，再从库中删除，返回条数。
+
+    先落盘再删除：若中途退出，下次会重复追加同一批行，读取时按 pk_id 去重。
+    """
+    db = SessionLocal()
+    try:
+        rows = db.query(SentMessage.pk_id, SentMessage.user_id, SentMessage.message_text, SentMessage.sent_at) \
+            .filter(SentMessage.sent_at < created_before) \
+            .order_by(SentMessage.sent_at, SentMessage.pk_id).limit(batch_size).all()
+        if not rows:
+            return 0
+        by_month = {}
+        for pk_id, user_id, text, sent_at in rows:
+            by_month.setdefault(archive_month(sent_at), []).append(
+                json.dumps({'pk_id': pk_id, 'user_id': user_id, 'text': text, 'sent_at': sent_at.isoformat()},
+                           ensure_ascii=False)
+            )
+        os.makedirs(archive_dir, exist_ok=True)
+        for month, lines in by_month.items():
+            with open(archive_path(month, archive_dir), 'ab') as f:
+                with gzip.GzipFile(fileobj=f, mode='ab') as gz:
+                    gz.write(('\n'.join(lines) + '\n').encode('utf-8'))
+                f.flush()
+                os.fsync(f.fileno())
+        db.execute(delete(SentMessage).where(SentMessage.pk_id.in_([row[0] for row in rows])))
+        db.commit()
+        return len(rows)
+    finally:
+        db.close()
+
+
+def _read_month(month, user_id, archive_dir):
+    needle = f'"user_id": {user_id},'.encode()
+    seen = set()
+    try:
+        with gzip.open(archive_path(month, archive_dir), 'rb') as gz:
+            for line in gz:
+                if needle not in line:
+                    continue
+                row = json.loads(line)
+                if row['user_id'] != user_id or row['pk_id'] in seen:
+                    continue
+                seen.add(row['pk_id'])
+                row['sent_at'] = datetime.datetime.fromisoformat(row['sent_at'])
+                yield row
+    except (EOFError, gzip.BadGzipFile, zlib.error):
+        # 机器人可能正在追加当月文件，读到未写完的尾部时到此为止。
+        return
+
+
+def _naive_utc(moment):
+    if moment is None or moment.tzinfo is None:
+        return moment
+    return moment.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+
+def search_archive(user_id, search='', start=None, end=None, before=None, limit=15, archive_dir=ARCHIVE_DIR):
+    """按 (sent_at, pk_id) 倒序返回某用户的归档消息，before 为上一页最后一行的 (sent_at, pk_id)。
+
+    返回 (rows, has_more)。按月从新到旧解压扫描，凑够 limit + 1 行即停止。
+    """
+    start, end = _naive_utc(start), _naive_utc(end)
+    before = (_naive_utc(before[0]), before[1]) if before else None
+    needle = search.lower()
+    rows = []
+    for month in archive_months(archive_dir):
+        if start and month < archive_month(start):
+            break
+        if (end and month > archive_month(end)) or (before and month > archive_month(before[0])):
+            continue
+        matched = [
+            row for row in _read_month(month, user_id, archive_dir)
+            if (not needle or needle in (row['text'] or '').lower())
+            and (not start or row['sent_at'] >= start)
+            and (not end or row['sent_at'] <= end)
+            and (not before or (row['sent_at'], row['pk_id']) < before)
+        ]
+        matched.sort(key=lambda row: (row['sent_at'], row['pk_id']), reverse=True)
+        rows.extend(matched)
+        if len(rows) > limit:
+            break
+    return rows[:limit], len(rows) > limit
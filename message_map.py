@@ -0,0 +1,90 @@
+import datetime
+from collections import OrderedDict
+
+from sqlalchemy import delete, select, or_, desc
+
+from database import SessionLocal, MessageMap, engine
+
+
+class ReplyTargetCache:
+    """最近转发消息 admin_msg_id → user_id 的 LRU，管理员回复近期消息时不必查询 SQLite。"""
+
+    def __init__(self, max_size=20000):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, admin_msg_id):
+        user_id = self._entries.get(admin_msg_id)
+        if user_id is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(admin_msg_id)
+        self.hits += 1
+        return user_id
+
+    def put(self, admin_msg_id, user_id):
+        self._entries[admin_msg_id] = user_id
+        self._entries.move_to_end(admin_msg_id)
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+def load_mapped_user_id(admin_msg_id: int):
+    db = SessionLocal()
+    try:
+        mapping = db.get(MessageMap, admin_msg_id)
+        return mapping.user_id if mapping else None
+    finally:
+        db.close()
+
+
+def retention_bounds(max_age_days, max_rows):
+    """返回 (created_before, max_admin_msg_id)，两者都为 None 表示不需要清理。
+
+    管理员会话里的消息 ID 单调递增，保留最新 max_rows 条即删除 ID 不大于第 max_rows+1 新映射的行。
+    """
+    created_before = None
+    if max_age_days:
+        created_before = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=max_age_days)
+    boundary = None
+    if max_rows:
+        db = SessionLocal()
+        try:
+            boundary = db.execute(
+                select(MessageMap.admin_msg_id).order_by(desc(MessageMap.admin_msg_id)).offset(max_rows).limit(1)
+            ).scalar()
+        finally:
+            db.close()
+    return created_before, boundary
+
+
+def delete_expired_batch(created_before, boundary, batch_size=5000):
+    conditions = []
+    if created_before is not None:
+        conditions.append(MessageMap.created_at < created_before)
+    if boundary is not None:
+        conditions.append(MessageMap.admin_msg_id <= boundary)
+    if not conditions:
+        return 0
+    victims = select(MessageMap.admin_msg_id).where(or_(*conditions)).limit(batch_size)
+    db = SessionLocal()
+    try:
+        deleted = db.execute(delete(MessageMap).where(MessageMap.admin_msg_id.in_(victims))).rowcount
+        db.commit()
+        return deleted
+    finally:
+        db.close()
+
+
+def incremental_vacuum(max_pages):
+    """把最多 max_pages 个空闲页归还给文件系统，返回剩余空闲页数。"""
+    # incremental_vacuum 每次 step 只释放一页，而 sqlite3 模块的 execute 对无结果列的语句只 step 一次，
+    # executescript 才会把语句执行完。
+    conn = engine.raw_connection()
+    try:
+        conn.driver_connection.executescript(f"PRAGMA incremental_vacuum({int(max_pages)});")
+        return conn.driver_connection.execute("PRAGMA freelist_count").fetchone()[0]
+    finally:
+        conn.close()
@@ -0,0 +1,59 @@
+import re
+
+from sqlalchemy import table, column, func, literal_column, text
+
+from database import SentMessage
+
+MIN_FTS_TERM_LENGTH = 3
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_END = '\x03'
+SNIPPET_TOKENS = 24
+USER_SCAN_LIMIT = 2000
+
+messages_fts = table('sent_messages_fts', column('rowid'))
+_fts_available = None
+
+
+def fts_available(session):
+    global _fts_available
+    if _fts_available is None:
+        _fts_available = session.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sent_messages_fts'")
+        ).first() is not None
+    return _fts_available
+
+
+def fts_phrase(term: str):
+    return '"' + term.replace('"', '""') + '"'
+
+
+def uses_fts(session, term: str, user_id=None):
+    if len(term) < MIN_FTS_TERM_LENGTH or not fts_available(session):
+        return False
+    if user_id is None:
+        return True
+    history = session.query(func.count()).filter(SentMessage.user_id == user_id).scalar()
+    return history > USER_SCAN_LIMIT
+
+
+def filter_messages(query, term: str, fts: bool):
+    if fts:
+        return query.join(messages_fts, messages_fts.c.rowid == SentMessage.pk_id) \
+            .filter(text("sent_messages_fts MATCH :fts_term").bindparams(fts_term=fts_phrase(term)))
+    return query.filter(SentMessage.message_text.like(f"%{term}%"))
+
+
+def snippet_column():
+    return func.snippet(literal_column('sent_messages_fts'), 0, HIGHLIGHT_START, HIGHLIGHT_END, '…',
+                        SNIPPET_TOKENS)
+
+
+def rank_column():
+    return literal_column('sent_messages_fts.rank')
+
+
+def highlight(message_text, term: str):
+    if not message_text or not term:
+        return message_text
+    return re.sub(re.escape(term), lambda m: f"{HIGHLIGHT_START}{m.group(0)}{HIGHLIGHT_END}", message_text,
+                  flags=re.IGNORECASE)
@@ -0,0 +1,128 @@
+import asyncio
+import logging
+
+from sqlalchemy import insert
+from sqlalchemy.exc import OperationalError
+
+from database import SessionLocal, MessageMap, SentMessage, run_db
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+def write_batch(batch):
+    grouped = {}
+    for model, row in batch:
+        grouped.setdefault(model, []).append(row)
+    db = SessionLocal()
+    try:
+        for model, rows in grouped.items():
+            db.execute(insert(model), rows)
+        db.commit()
+    finally:
+        db.close()
+
+
+class MessageWriter:
+    """后台批量写入转发记录：处理器只负责入队，由单独的任务按条数或时间批量落盘。"""
+
+    def __init__(self, batch_size=200, flush_interval=0.5, retries=4, retry_delay=0.5):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.pending_maps = {}
+        self._failed = []
+        self._queue = None
+        self._task = None
+
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run(), name='message_writer')
+
+    def enqueue(self, model, row):
+        self._queue.put_nowait((model, row))
+
+    def log_forwarded(self, admin_msg_id, user_id, text, sent_at):
+        self.pending_maps[admin_msg_id] = user_id
+        self.enqueue(MessageMap, {'admin_msg_id': admin_msg_id, 'user_id': user_id, 'created_at': sent_at})
+        self.enqueue(SentMessage, {'user_id': user_id, 'message_text': text, 'sent_at': sent_at})
+
+    def lookup_user_id(self, admin_msg_id):
+        return self.pending_maps.get(admin_msg_id)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+        if self._failed:
+            await self._flush([])
+
+    async def _flush(self, batch):
+        """数据库被锁等临时错误按指数退避重试，仍失败则保留到下一批一起写；映射在提交成功后才移出 pending_maps。"""
+        batch = self._failed + batch
+        self._failed = []
+        for attempt in range(self.retries + 1):
+            try:
+                await run_db(write_batch, batch)
+                break
+            except OperationalError as e:
+                if attempt == self.retries:
+                    logger.error(f"Failed to persist {len(batch)} queued rows, keeping them for the next batch: {e}")
+                    self._failed = batch
+                    return
+                delay = self.retry_delay * 2 ** attempt
+                logger.warning(f"Failed to persist {len(batch)} queued rows, retrying in {delay}s: {e}")
+                await asyncio.sleep(delay)
+            except Exception as e:
+                # 约束冲突之类的错误整批重试也不会成功：逐行重写，只丢弃写不进去的行。
+                logger.warning(f"Failed to persist {len(batch)} queued rows, retrying one by one: {e}")
+                await self._write_rows_singly(batch)
+                break
+        retained = {row['admin_msg_id'] for model, row in self._failed if model is MessageMap}
+        for model, row in batch:
+            if model is MessageMap and row['admin_msg_id'] not in retained:
+                self.pending_maps.pop(row['admin_msg_id'], None)
+
+    async def _write_rows_singly(self, batch):
+        dropped = 0
+        for model, row in batch:
+            try:
+                await run_db(write_batch, [(model, row)])
+            except OperationalError:
+                self._failed.append((model, row))
+            except Exception as e:
+                dropped += 1
+                logger.error(f"Dropping queued {model.__tablename__} row {row}: {e}")
+        if dropped:
+            logger.error(f"Dropped {dropped} of {len(batch)} queued rows that could not be persisted.")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._queue.put_nowait(_STOP)
+        await self._task
+        self._task = None
+        if self._failed:
+            logger.error(f"Message writer stopped with {len(self._failed)} unpersisted rows.")
+        else:
+            logger.info("Message writer drained.")
@@ -0,0 +1,61 @@
+import base64
+import datetime
+import json
+
+from sqlalchemy import desc, tuple_
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(sort_value, row_id):
+    if isinstance(sort_value, datetime.datetime):
+        sort_value = sort_value.isoformat()
+    raw = json.dumps([sort_value, row_id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        sort_value, row_id = json.loads(raw)
+        if sort_value is not None:
+            sort_value = datetime.datetime.fromisoformat(sort_value)
+        return sort_value, int(row_id)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor(str(e)) from e
+
+
+def page_size(value, default=DEFAULT_PAGE_SIZE):
+    if not value or value <= 0:
+        return default
+    return min(value, MAX_PAGE_SIZE)
+
+
+def keyset_page(query, sort_column, id_column, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """按 (sort_column, id_column) 倒序分页，sort_column 为 NULL 的行排在最后。返回 (rows, next_cursor)。
+
+    非空部分与 NULL 部分分别查询，两段都能走 (sort_column, id) 索引的范围扫描。
+    """
+    sort_value, row_id = decode_cursor(cursor) if cursor else (None, None)
+    rows = []
+    if not cursor or sort_value is not None:
+        head = query.filter(sort_column.isnot(None))
+        if cursor:
+            head = head.filter(tuple_(sort_column, id_column) < tuple_(sort_value, row_id))
+        rows = head.order_by(desc(sort_column), desc(id_column)).limit(limit + 1).all()
+    if len(rows) <= limit:
+        tail = query.filter(sort_column.is_(None))
+        if cursor and sort_value is None:
+            tail = tail.filter(id_column < row_id)
+        rows += tail.order_by(desc(id_column)).limit(limit + 1 - len(rows)).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, sort_column.key), getattr(last, id_column.key))
+    return rows, next_cursor
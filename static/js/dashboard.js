@@ -49,22 +49,19 @@ document.addEventListener('DOMContentLoaded', () => {
 
     const state = {
         keywords: {
-            list: [],
-            currentPage: 1,
             search: '',
             filter: 'all'
         },
         users: {
-            currentPage: 1,
             search: '',
             filter: 'all'
         },
         chat: {
             userId: null,
-            page: 1,
             search: '',
             start: '',
-            end: ''
+            end: '',
+            archive: false
         },
         sidebarCollapsed: false,
         theme: localStorage.getItem('theme') || 'auto',
@@ -154,8 +151,8 @@ document.addEventListener('DOMContentLoaded', () => {
             keywords: '屏蔽关键词'
         }[pageId];
         if (pageId === 'dashboard') loadStats();
-        if (pageId === 'users') updateUsersAndLoad();
-        if (pageId === 'keywords') updateKwAndLoad();
+        if (pageId === 'users') userList.reset();
+        if (pageId === 'keywords') keywordList.reset();
         if (pageId === 'bot-settings') loadBotSettings();
     }
 
@@ -198,6 +195,9 @@ document.addEventListener('DOMContentLoaded', () => {
             document.getElementById('new-users-today').textContent = today.new_users_today;
             document.getElementById('dialog-users-today').textContent = today.dialog_users_today;
             document.getElementById('messages-today').textContent = today.messages_today;
+            document.getElementById('blocked-hits-today').textContent = today.blocked_hits_today;
+            document.getElementById('verifications-passed-today').textContent = today.verifications_passed_today;
+            document.getElementById('verifications-failed-today').textContent = today.verifications_failed_today;
             loadStartMessages();
 
             const rangeSelect = document.getElementById('range-select');
@@ -226,6 +226,10 @@ document.addEventListener('DOMContentLoaded', () => {
             document.getElementById('update_method_dashboard').value = settings.update_method;
             document.getElementById('webhook_domain_dashboard').value = settings.webhook_domain || '';
             document.getElementById('webhook_secret_dashboard').value = settings.webhook_secret || '';
+            document.getElementById('max_concurrent_updates').value = settings.max_concurrent_updates || 16;
+            document.getElementById('message_map_max_age_days').value = settings.message_map_max_age_days ?? 90;
+            document.getElementById('message_map_max_rows').value = settings.message_map_max_rows ?? 500000;
+            document.getElementById('message_retention_days').value = settings.message_retention_days ?? 0;
             toggleWebhookDashboardFields();
         } catch (error) {
             showToast('加载机器人设置失败', 'error');
@@ -242,6 +246,10 @@ document.addEventListener('DOMContentLoaded', () => {
             update_method: document.getElementById('update_method_dashboard').value,
             webhook_domain: document.getElementById('webhook_domain_dashboard').value,
             webhook_secret: document.getElementById('webhook_secret_dashboard').value,
+            max_concurrent_updates: parseInt(document.getElementById('max_concurrent_updates').value, 10),
+            message_map_max_age_days: parseInt(document.getElementById('message_map_max_age_days').value, 10) || 0,
+            message_map_max_rows: parseInt(document.getElementById('message_map_max_rows').value, 10) || 0,
+            message_retention_days: parseInt(document.getElementById('message_retention_days').value, 10) || 0,
         };
         try {
             const response = await apiFetch('/api/settings', {
@@ -349,6 +357,66 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
 
+    function createInfiniteList({ container, status, root = null, itemsKey, renderItem, emptyHTML, errorText, buildUrl }) {
+        const list = { cursor: null, done: true, loading: false, total: null, generation: 0 };
+        const observer = new IntersectionObserver(entries => {
+            if (entries.some(entry => entry.isIntersecting)) loadMore();
+        }, { root, rootMargin: '200px' });
+
+        function renderStatus() {
+            if (list.loading) {
+                status.textContent = '加载中...';
+            } else if (list.done && list.total) {
+                status.textContent = `已全部加载，共 ${list.total} 条`;
+            } else {
+                status.textContent = '';
+            }
+        }
+
+        async function loadMore() {
+            if (list.loading || list.done) return;
+            const generation = list.generation;
+            const first = list.cursor === null;
+            list.loading = true;
+            renderStatus();
+            try {
+                const data = await apiFetch(buildUrl(list.cursor, first));
+                if (generation !== list.generation) return;
+                if (first) {
+                    container.innerHTML = '';
+                    list.total = data.total;
+                    if (data[itemsKey].length === 0) container.innerHTML = emptyHTML;
+                }
+                data[itemsKey].forEach(item => container.appendChild(renderItem(item)));
+                list.cursor = data.next_cursor;
+                list.done = !data.next_cursor;
+            } catch (error) {
+                if (generation !== list.generation) return;
+                list.done = true;
+                showToast(errorText, 'error');
+            } finally {
+                if (generation === list.generation) {
+                    list.loading = false;
+                    renderStatus();
+                    observer.unobserve(status);
+                    observer.observe(status);
+                }
+            }
+        }
+
+        function reset() {
+            list.generation++;
+            list.cursor = null;
+            list.done = false;
+            list.loading = false;
+            list.total = null;
+            loadMore();
+        }
+
+        observer.observe(status);
+        return { reset };
+    }
+
     const kwTbody = document.getElementById('keyword-list-tbody');
     const kwSearch = document.getElementById('keyword-search');
     const kwFilter = document.getElementById('keyword-filter');
@@ -356,41 +424,27 @@ document.addEventListener('DOMContentLoaded', () => {
     const kwInput = document.getElementById('keyword-input');
     const addKwBtn = document.getElementById('add-keyword-btn');
 
-    function updateKwAndLoad(page = 1) {
-        state.keywords.currentPage = page;
-        loadKeywords();
-    }
-
-    function renderKeywords(data) {
-        kwTbody.innerHTML = '';
-        if (data.keywords.length === 0) {
-            kwTbody.innerHTML = '<tr><td colspan="3" style="text-align: center; color: var(--text-secondary-color);">未找到关键词</td></tr>';
-            return;
-        }
-        data.keywords.forEach(kw => {
-            const tr = document.createElement('tr');
-            tr.innerHTML = `
-                <td><strong>${escapeHTML(kw.keyword)}</strong></td>
-                <td>${formatTime(kw.added_at)}</td>
-                <td><button class="btn btn-danger btn-sm" data-id="${kw.id}">删除</button></td>
-            `;
-            tr.querySelector('button').addEventListener('click', () => deleteKeyword(kw.id, kw.keyword));
-            kwTbody.appendChild(tr);
-        });
-        renderPagination(data.page, data.total_pages, kwPagination, updateKwAndLoad);
-    }
-
-    async function loadKeywords() {
-        const { currentPage, search } = state.keywords;
-        const url = `/api/keywords?page=${currentPage}&search=${encodeURIComponent(search)}`;
-        try {
-            const data = await apiFetch(url);
-            state.keywords.list = data.keywords;
-            renderKeywords(data);
-        } catch (error) {
-            showToast('加载关键词失败', 'error');
-        }
-    }
+    function renderKeyword(kw) {
+        const tr = document.createElement('tr');
+        tr.innerHTML = `
+            <td><strong>${escapeHTML(kw.keyword)}</strong></td>
+            <td>${formatTime(kw.added_at)}</td>
+            <td><button class="btn btn-danger btn-sm" data-id="${kw.id}">删除</button></td>
+        `;
+        tr.querySelector('button').addEventListener('click', () => deleteKeyword(kw.id, kw.keyword));
+        return tr;
+    }
+
+    const keywordList = createInfiniteList({
+        container: kwTbody,
+        status: kwPagination,
+        itemsKey: 'keywords',
+        renderItem: renderKeyword,
+        emptyHTML: '<tr><td colspan="3" style="text-align: center; color: var(--text-secondary-color);">未找到关键词</td></tr>',
+        errorText: '加载关键词失败',
+        buildUrl: (cursor, withTotal) =>
+            `/api/keywords?search=${encodeURIComponent(state.keywords.search)}&cursor=${cursor || ''}&with_total=${withTotal ? 1 : 0}`
+    });
 
     async function addKeyword() {
         const inputValue = kwInput.value.trim();
@@ -405,7 +459,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify({ keywords })
             });
-            updateKwAndLoad(1);
+            keywordList.reset();
             kwInput.value = '';
             showToast(`成功添加 ${added.length} 个关键词，已存在 ${exists.length} 个`);
         } catch (error) {
@@ -423,13 +477,32 @@ document.addEventListener('DOMContentLoaded', () => {
         if (!confirmed) return;
         try {
             await apiFetch(`/api/keywords/${id}`, { method: 'DELETE' });
-            updateKwAndLoad();
+            keywordList.reset();
             showToast('关键词删除成功');
         } catch (error) {
             showToast('删除关键词失败', 'error');
         }
     }
 
+    async function importKeywordFile(file) {
+        const formData = new FormData();
+        formData.append('file', file);
+        try {
+            const result = await apiFetch('/api/keywords/import', { method: 'POST', body: formData });
+            keywordList.reset();
+            showToast(`导入完成：新增 ${result.added} 个，已存在 ${result.existing} 个，重复 ${result.duplicates} 个`);
+        } catch (error) {
+            showToast(`导入关键词失败: ${error.message}`, 'error');
+        }
+    }
+
+    const kwImportFile = document.getElementById('keyword-import-file');
+    document.getElementById('import-keyword-btn').addEventListener('click', () => kwImportFile.click());
+    kwImportFile.addEventListener('change', () => {
+        if (kwImportFile.files.length) importKeywordFile(kwImportFile.files[0]);
+        kwImportFile.value = '';
+    });
+
     addKwBtn.addEventListener('click', addKeyword);
     kwInput.addEventListener('keypress', (e) => {
         if (e.key === 'Enter' && !e.shiftKey) {
@@ -440,12 +513,12 @@ document.addEventListener('DOMContentLoaded', () => {
 
     kwSearch.addEventListener('input', debounce(() => {
         state.keywords.search = kwSearch.value.trim();
-        updateKwAndLoad(1);
+        keywordList.reset();
     }, 300));
 
     kwFilter.addEventListener('change', () => {
         state.keywords.filter = kwFilter.value;
-        updateKwAndLoad(1);
+        keywordList.reset();
     });
 
     const userTbody = document.getElementById('user-list-tbody');
@@ -453,108 +526,81 @@ document.addEventListener('DOMContentLoaded', () => {
     const userFilter = document.getElementById('user-filter');
     const userPagination = document.getElementById('user-pagination');
 
-    function renderPagination(currentPage, totalPages, container, loadFunc) {
-        container.innerHTML = '';
-        if (totalPages <= 1) return;
-        const createBtn = (page, text = page, active = false, disabled = false) => {
-            const btn = document.createElement('button');
-            btn.textContent = text;
-            if (page) btn.dataset.page = page;
-            if (active) btn.classList.add('active');
-            if (disabled) btn.disabled = true;
-            if (page) btn.addEventListener('click', () => {
-                loadFunc(page);
-            });
-            return btn;
-        };
-        container.appendChild(createBtn(currentPage > 1 ? currentPage - 1 : null, '«', false, currentPage === 1));
-        let start = Math.max(1, currentPage - 2);
-        let end = Math.min(totalPages, currentPage + 2);
-        if (start > 1) container.appendChild(createBtn(1));
-        if (start > 2) container.appendChild(createBtn(null, '...', false, true));
-        for (let i = start; i <= end; i++) {
-            container.appendChild(createBtn(i, i, i === currentPage));
-        }
-        if (end < totalPages - 1) container.appendChild(createBtn(null, '...', false, true));
-        if (end < totalPages) container.appendChild(createBtn(totalPages));
-        container.appendChild(createBtn(currentPage < totalPages ? currentPage + 1 : null, '»', false, currentPage === totalPages));
-    }
-
-    function updateUsersAndLoad(page = 1) {
-        state.users.currentPage = page;
-        loadUsers();
-    }
-
-    function renderUsers(data) {
-        userTbody.innerHTML = '';
-        if (data.users.length === 0) {
-            userTbody.innerHTML = '<tr><td colspan="6" style="text-align: center; color: var(--text-secondary-color);">未找到用户</td></tr>';
-            return;
-        }
-        data.users.forEach(user => {
-            const tr = document.createElement('tr');
-            const username = user.username ? `@${user.username}` : (user.first_name || 'N/A');
-            const statusBadge = user.is_blocked
-                ? `<span class="badge badge-blocked">已屏蔽</span>`
-                : `<span class="badge badge-active">正常</span>`;
-            const verifyBadge = user.is_verified
-                ? `<span class="badge badge-active">已验证</span>`
-                : `<span class="badge" style="background: color-mix(in srgb, #fbbf24, transparent 90%); color: #fbbf24;">未验证</span>`;
-            const actionButton = user.is_blocked
-                ? `<button class="btn btn-success btn-sm" data-id="${user.id}">解禁</button>`
-                : `<button class="btn btn-danger btn-sm" data-id="${user.id}">屏蔽</button>`;
-            const verifyButton = user.is_verified
-                ? `<button class="btn btn-sm" style="background: #f59e0b; color: white;" data-id="${user.id}">取消验证</button>`
-                : `<button class="btn btn-success btn-sm" data-id="${user.id}">通过验证</button>`;
-
-            tr.innerHTML = `
-                <td>
-                    <div class="user-info">
-                        <strong>${escapeHTML(username)}</strong>
-                        <span>${escapeHTML(user.first_name || '')} ${escapeHTML(user.last_name || '')}</span>
-                    </div>
-                </td>
-                <td>
-                    <div class="user-info">
-                        <code>${user.id}</code>
-                        <span>${escapeHTML(user.lang_code || 'N/A')}</span>
-                    </div>
-                </td>
-                <td>${statusBadge}</td>
-                <td>${verifyBadge}</td>
-                <td>
-                    <div class="user-info">
-                        <span>${formatTime(user.created_at)}</span>
-                        <strong style="color: var(--success-color);">${formatTime(user.verified_at)}</strong>
-                    </div>
-                </td>
-                <td>
-                    <div class="user-actions">
-                        <button class="btn btn-sm btn-primary view-chat-btn" data-id="${user.id}">查看聊天</button>
-                        ${actionButton}
-                        ${verifyButton}
-                    </div>
-                </td>
-            `;
-            tr.querySelector('.view-chat-btn').addEventListener('click', () => {
-                openChatModal(user.id);
-            });
-
-            const blockBtn = tr.querySelector('.btn-danger, .btn-success');
-            blockBtn.addEventListener('click', () => {
-                toggleUserBlock(user.id, !user.is_blocked);
-            });
+    function renderUser(user) {
+        const tr = document.createElement('tr');
+        const username = user.username ? `@${user.username}` : (user.first_name || 'N/A');
+        const statusBadge = user.is_blocked
+            ? `<span class="badge badge-blocked">已屏蔽</span>`
+            : `<span class="badge badge-active">正常</span>`;
+        const verifyBadge = user.is_verified
+            ? `<span class="badge badge-active">已验证</span>`
+            : `<span class="badge" style="background: color-mix(in srgb, #fbbf24, transparent 90%); color: #fbbf24;">未验证</span>`;
+        const actionButton = user.is_blocked
+            ? `<button class="btn btn-success btn-sm" data-id="${user.id}">解禁</button>`
+            : `<button class="btn btn-danger btn-sm" data-id="${user.id}">屏蔽</button>`;
+        const verifyButton = user.is_verified
+            ? `<button class="btn btn-sm" style="background: #f59e0b; color: white;" data-id="${user.id}">取消验证</button>`
+            : `<button class="btn btn-success btn-sm" data-id="${user.id}">通过验证</button>`;
+
+        tr.innerHTML = `
+            <td>
+                <div class="user-info">
+                    <strong>${escapeHTML(username)}</strong>
+                    <span>${escapeHTML(user.first_name || '')} ${escapeHTML(user.last_name || '')}</span>
+                </div>
+            </td>
+            <td>
+                <div class="user-info">
+                    <code>${user.id}</code>
+                    <span>${escapeHTML(user.lang_code || 'N/A')}</span>
+                </div>
+            </td>
+            <td>${statusBadge}</td>
+            <td>${verifyBadge}</td>
+            <td>
+                <div class="user-info">
+                    <span>${formatTime(user.created_at)}</span>
+                    <strong style="color: var(--success-color);">${formatTime(user.verified_at)}</strong>
+                </div>
+            </td>
+            <td>
+                <div class="user-actions">
+                    <button class="btn btn-sm btn-primary view-chat-btn" data-id="${user.id}">查看聊天</button>
+                    ${actionButton}
+                    ${verifyButton}
+                </div>
+            </td>
+        `;
+        tr.querySelector('.view-chat-btn').addEventListener('click', () => {
+            openChatModal(user.id);
+        });
 
-            const verifyBtn = tr.querySelectorAll('.btn-sm')[2];
-            verifyBtn.addEventListener('click', () => {
-                toggleUserVerify(user.id, !user.is_verified);
-            });
+        const blockBtn = tr.querySelector('.btn-danger, .btn-success');
+        blockBtn.addEventListener('click', () => {
+            toggleUserBlock(user.id, !user.is_blocked);
+        });
 
-            userTbody.appendChild(tr);
+        const verifyBtn = tr.querySelectorAll('.btn-sm')[2];
+        verifyBtn.addEventListener('click', () => {
+            toggleUserVerify(user.id, !user.is_verified);
         });
-        renderPagination(data.page, data.total_pages, userPagination, updateUsersAndLoad);
+
+        return tr;
     }
 
+    const userList = createInfiniteList({
+        container: userTbody,
+        status: userPagination,
+        itemsKey: 'users',
+        renderItem: renderUser,
+        emptyHTML: '<tr><td colspan="6" style="text-align: center; color: var(--text-secondary-color);">未找到用户</td></tr>',
+        errorText: '加载用户列表失败',
+        buildUrl: (cursor, withTotal) => {
+            const { search, filter } = state.users;
+            return `/api/users?search=${encodeURIComponent(search)}&filter=${filter}&cursor=${cursor || ''}&with_total=${withTotal ? 1 : 0}`;
+        }
+    });
+
     async function toggleUserVerify(userId, shouldVerify) {
         const action = shouldVerify ? 'verify' : 'unverify';
         const title = shouldVerify ? '通过验证' : '取消验证';
@@ -566,23 +612,12 @@ document.addEventListener('DOMContentLoaded', () => {
         try {
             await apiFetch(`/api/users/${userId}/${action}`, { method: 'POST' });
             showToast(shouldVerify ? '用户已通过验证' : '用户验证已取消');
-            updateUsersAndLoad();
+            userList.reset();
         } catch (error) {
             showToast('操作失败', 'error');
         }
     }
 
-    async function loadUsers() {
-        const { currentPage, search, filter } = state.users;
-        const url = `/api/users?page=${currentPage}&search=${encodeURIComponent(search)}&filter=${filter}`;
-        try {
-            const data = await apiFetch(url);
-            renderUsers(data);
-        } catch (error) {
-            showToast('加载用户列表失败', 'error');
-        }
-    }
-
     async function toggleUserBlock(userId, shouldBlock) {
         const action = shouldBlock ? 'block' : 'unblock';
         const title = shouldBlock ? '屏蔽用户' : '解禁用户';
@@ -594,7 +629,7 @@ document.addEventListener('DOMContentLoaded', () => {
         try {
             await apiFetch(`/api/users/${userId}/${action}`, { method: 'POST' });
             showToast(shouldBlock ? '用户已屏蔽' : '用户已解禁');
-            updateUsersAndLoad();
+            userList.reset();
         } catch (error) {
             showToast('操作失败', 'error');
         }
@@ -602,18 +637,22 @@ document.addEventListener('DOMContentLoaded', () => {
 
     userSearch.addEventListener('input', debounce(() => {
         state.users.search = userSearch.value.trim();
-        updateUsersAndLoad(1);
+        userList.reset();
     }, 300));
 
     userFilter.addEventListener('change', () => {
         state.users.filter = userFilter.value;
-        updateUsersAndLoad(1);
+        userList.reset();
     });
 
     function escapeHTML(str) {
         return String(str || '').replace(/[&<>"']/g, m => ({ '&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;' }[m]));
     }
 
+    function renderHighlight(str) {
+        return escapeHTML(str).replace(/\x02/g, '<mark>').replace(/\x03/g, '</mark>');
+    }
+
     function formatTime(isoString) {
         if (!isoString) return 'N/A';
         try {
@@ -711,65 +750,56 @@ document.addEventListener('DOMContentLoaded', () => {
         loadMessageChart(parseInt(rangeSelect.value));
     });
 
+    const chatList = createInfiniteList({
+        container: document.getElementById('chat-list'),
+        status: document.getElementById('chat-pagination'),
+        root: document.getElementById('chat-scroll'),
+        itemsKey: 'messages',
+        renderItem: m => {
+            const div = document.createElement('div');
+            div.style.padding = '0.5rem 0';
+            div.innerHTML = `
+                <div style="font-size:0.85rem;color:var(--text-secondary-color);">${formatTime(m.sent_at)}${m.archived ? ' · 已归档' : ''}</div>
+                <div>${renderHighlight(m.highlighted || m.text || '')}</div>
+                <hr>
+            `;
+            return div;
+        },
+        emptyHTML: `<p style="color:var(--text-secondary-color);text-align:center;">无聊天记录</p>`,
+        errorText: '加载聊天记录失败',
+        buildUrl: (cursor, withTotal) => {
+            const s = state.chat;
+            return `/api/user_messages?user_id=${s.userId}&search=${encodeURIComponent(s.search)}&start=${s.start}&end=${s.end}&include_archive=${s.archive ? 1 : 0}&cursor=${cursor || ''}&with_total=${withTotal ? 1 : 0}`;
+        }
+    });
+
     function openChatModal(userId) {
         state.chat.userId = userId;
-        state.chat.page = 1;
-        loadChatMessages();
+        document.getElementById('chat-list').innerHTML = '';
+        chatList.reset();
         const modal = document.getElementById('chat-modal');
         modal.style.display = 'flex';
         setTimeout(() => modal.classList.add('show'), 10);
     }
 
-    async function loadChatMessages() {
-        const s = state.chat;
-        const url = `/api/user_messages?user_id=${s.userId}&page=${s.page}&search=${encodeURIComponent(s.search)}&start=${s.start}&end=${s.end}`;
-        try {
-            const data = await apiFetch(url);
-
-            const list = document.getElementById('chat-list');
-            list.innerHTML = '';
-
-            if (data.messages.length === 0) {
-                list.innerHTML = `<p style="color:var(--text-secondary-color);text-align:center;">无聊天记录</p>`;
-            } else {
-                data.messages.forEach(m => {
-                    const div = document.createElement('div');
-                    div.style.padding = '0.5rem 0';
-                    div.innerHTML = `
-                        <div style="font-size:0.85rem;color:var(--text-secondary-color);">${formatTime(m.sent_at)}</div>
-                        <div>${escapeHTML(m.text || '')}</div>
-                        <hr>
-                    `;
-                    list.appendChild(div);
-                });
-            }
-
-            renderPagination(data.page, data.total_pages, document.getElementById('chat-pagination'), (p) => {
-                state.chat.page = p;
-                loadChatMessages();
-            });
-
-        } catch(e) {
-            showToast('加载聊天记录失败', 'error');
-        }
-    }
-
     document.getElementById('chat-search').addEventListener('input', debounce(() => {
         state.chat.search = document.getElementById('chat-search').value.trim();
-        state.chat.page = 1;
-        loadChatMessages();
+        chatList.reset();
     }, 300));
 
     document.getElementById('chat-start').addEventListener('change', () => {
         state.chat.start = document.getElementById('chat-start').value;
-        state.chat.page = 1;
-        loadChatMessages();
+        chatList.reset();
     });
 
     document.getElementById('chat-end').addEventListener('change', () => {
         state.chat.end = document.getElementById('chat-end').value;
-        state.chat.page = 1;
-        loadChatMessages();
+        chatList.reset();
+    });
+
+    document.getElementById('chat-archive').addEventListener('change', () => {
+        state.chat.archive = document.getElementById('chat-archive').checked;
+        chatList.reset();
     });
 
     document.getElementById('chat-close').addEventListener('click', () => {
@@ -0,0 +1,66 @@
+import logging
+
+from sqlalchemy import table, column, func, select, or_, text
+
+from database import User
+from message_search import fts_phrase
+
+logger = logging.getLogger(__name__)
+
+MIN_FTS_TERM_LENGTH = 3
+SLOW_SEARCH_MS = 100
+
+users_fts = table('users_fts', column('rowid'))
+_fts_available = None
+
+
+def fts_available(session):
+    global _fts_available
+    if _fts_available is None:
+        _fts_available = session.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users_fts'")
+        ).first() is not None
+    return _fts_available
+
+
+def prefix_match(column_, prefix: str):
+    """lower(column) 的前缀范围条件，可走 ix_users_*_lower 表达式索引。"""
+    prefix = prefix.lower()
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return (func.lower(column_) >= prefix) & (func.lower(column_) < upper)
+
+
+def filter_users(session, query, term: str):
+    """按搜索词选择检索方式，返回 (query, strategy)。
+
+    纯数字按 ID 精确查找；@ 开头按用户名前缀；三个字符以上走 users_fts 三元组索引；
+    一两个字符的短词三元组索引无法处理，只按用户名和姓名前缀匹配，避免全表 LIKE 扫描。
+    """
+    term = term.strip()
+    if term.isdigit():
+        return query.filter(User.id == int(term)), 'id'
+    if term.startswith('@') and len(term) > 1:
+        return query.filter(prefix_match(User.username, term[1:])), 'prefix'
+    if len(term) >= MIN_FTS_TERM_LENGTH:
+        if fts_available(session):
+            matched = select(users_fts.c.rowid).where(
+                text("users_fts MATCH :user_term").bindparams(user_term=fts_phrase(term))
+            )
+            return query.filter(User.id.in_(matched)), 'fts'
+        pattern = f"%{term}%"
+        return query.filter(or_(
+            User.username.like(pattern),
+            User.first_name.like(pattern),
+            User.last_name.like(pattern)
+        )), 'like'
+    return query.filter(or_(
+        prefix_match(User.username, term),
+        prefix_match(User.first_name, term),
+        prefix_match(User.last_name, term)
+    )), 'prefix'
+
+
+def log_search(term: str, strategy: str, rows: int, seconds: float):
+    elapsed_ms = seconds * 1000
+    level = logging.WARNING if elapsed_ms >= SLOW_SEARCH_MS else logging.INFO
+    logger.log(level, f"User search {term!r} via {strategy}: {rows} rows in {elapsed_ms:.1f}ms")
@@ -0,0 +1,118 @@
+import datetime
+import heapq
+import json
+import logging
+import time
+
+from sqlalchemy import insert, delete
+
+from database import SessionLocal, PendingVerification
+
+logger = logging.getLogger(__name__)
+
+
+class VerificationStore:
+    """进行中的验证挑战：按过期时间排序的小顶堆淘汰，带容量上限，可快照到 SQLite 以跨重启保留。"""
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self.evicted = 0
+        self.dirty = False
+        self._entries = {}
+        self._stamps = {}
+        self._heap = []
+        self._seq = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, chat_id):
+        return chat_id in self._entries
+
+    def put(self, chat_id, entry: dict):
+        self._seq += 1
+        self._entries[chat_id] = entry
+        self._stamps[chat_id] = self._seq
+        heapq.heappush(self._heap, (entry['expiry'].timestamp(), self._seq, chat_id))
+        self.dirty = True
+        while len(self._entries) > self.max_size:
+            self._pop_soonest()
+            self.evicted += 1
+
+    def get(self, chat_id):
+        entry = self._entries.get(chat_id)
+        if entry is not None and entry['expiry'].timestamp() <= time.time():
+            self.discard(chat_id)
+            return None
+        return entry
+
+    def discard(self, chat_id):
+        if self._entries.pop(chat_id, None) is not None:
+            del self._stamps[chat_id]
+            self.dirty = True
+
+    def _pop_soonest(self):
+        while self._heap:
+            _, seq, chat_id = heapq.heappop(self._heap)
+            if self._stamps.get(chat_id) == seq:
+                self.discard(chat_id)
+                return chat_id
+        return None
+
+    def sweep(self, now=None):
+        now = time.time() if now is None else now
+        removed = 0
+        while self._heap and self._heap[0][0] <= now:
+            _, seq, chat_id = heapq.heappop(self._heap)
+            if self._stamps.get(chat_id) == seq:
+                self.discard(chat_id)
+                removed += 1
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            self._heap = [(entry['expiry'].timestamp(), self._stamps[chat_id], chat_id)
+                          for chat_id, entry in self._entries.items()]
+            heapq.heapify(self._heap)
+        return removed
+
+    def snapshot(self):
+        self.dirty = False
+        return [(chat_id, dict(entry)) for chat_id, entry in self._entries.items()]
+
+    def restore(self, rows):
+        for chat_id, entry in rows:
+            self.put(chat_id, entry)
+        self.dirty = False
+
+
+def save_verifications(rows):
+    db = SessionLocal()
+    try:
+        db.execute(delete(PendingVerification))
+        if rows:
+            db.execute(insert(PendingVerification), [
+                {
+                    'chat_id': chat_id,
+                    'data': json.dumps({k: v for k, v in entry.items() if k != 'expiry'}),
+                    'expires_at': entry['expiry'].astimezone(datetime.timezone.utc),
+                }
+                for chat_id, entry in rows
+            ])
+        db.commit()
+    finally:
+        db.close()
+
+
+def load_verifications():
+    now = datetime.datetime.now(datetime.timezone.utc)
+    db = SessionLocal()
+    try:
+        rows = []
+        for row in db.query(PendingVerification).all():
+            expiry = row.expires_at.replace(tzinfo=datetime.timezone.utc)
+            if expiry <= now:
+                continue
+            entry = json.loads(row.data)
+            entry['expiry'] = expiry
+            rows.append((row.chat_id, entry))
+        return rows
+    finally:
+        db.close()